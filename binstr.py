@@ -1,14 +1,33 @@
 import sys
+import os
+import time
+import mmap
 import sublime
 import sublime_plugin
 from . import sbot_common as sc
+from . import binstr_core as bc
 
 
 # TODO Insert/edit unicode from numerical/clipboard/region or from glyph picker.
 
 
-# Expected/common binary chars.
-com_bin = { '\0':'NUL', '\n':'LF', '\r':'CR', '\t':'TAB', '\033':'ESC' }
+# Bytes per dump row.
+ROW_SIZE = bc.ROW_SIZE
+
+# Bytes formatted per block. Multiple of ROW_SIZE.
+CHUNK_SIZE = 64 * 1024
+
+# Chars processed per block for text commands.
+TEXT_CHUNK_SIZE = 256 * 1024
+
+# Background job for all bin commands - only one at a time.
+JOB_NAME = 'Bin'
+
+# Recolor streaming output at most this often (sec). Each time resends all the regions.
+COLOR_INTERVAL = 1.0
+
+# Paged dump views. Key is view id, value is _DumpPager.
+_pagers = {}
 
 
 #-----------------------------------------------------------------------------------
@@ -19,53 +38,29 @@ class SbotBinTranslateCommand(sublime_plugin.TextCommand):
 
         settings = sublime.load_settings(sc.get_settings_fn())
         translate_delims = settings.get('translate_delims')
-        color_ascii = str(settings.get('color_ascii'))
-        color_unicode = str(settings.get('color_unicode'))
         left_delim = translate_delims[0] or ''   # pyright: ignore
         right_delim = translate_delims[1] or ''   # pyright: ignore
 
-        buff = []
-        regions_ascii = []
-        regions_unicode = []
-        out_pos = 0 # in output view
-
-        region = sc.get_sel_regions(self.view)[0] 
-
-        # Iterate lines in selection.
-        for region_line in self.view.split_by_newlines(region):
-            text = self.view.substr(region_line)
-            for ch in text:
-                if ch >= ' ' and ch <= '~': # ascii printable
-                    buff.append(ch)
-                    out_pos += 1
-
-                elif ch in com_bin:
-                    start_pos = out_pos
-                    sout = com_bin[ch]
-                    buff.append(sout)
-                    out_pos += len(sout)
-                    regions_ascii.append(sublime.Region(start_pos, out_pos)) # color range
-
-                else: # Everything else is binary.
-                    start_pos = out_pos
-
-                    if ch < ' ':
-                        sout = f'{left_delim}0x{ord(ch):02X}{right_delim}'
-                        buff.append(sout)
-                        out_pos += len(sout)
-                        regions_ascii.append(sublime.Region(start_pos, out_pos))
-                    else:
-                        sout = f'{left_delim}U+{ord(ch):04X}{right_delim}'
-                        buff.append(sout)
-                        out_pos += len(sout)
-                        regions_unicode.append(sublime.Region(start_pos, out_pos))
-
-            buff.append('\n')
-            out_pos += 1 # for LF
-
-        new_view = sc.create_new_view(self.view.window(), ''.join(buff))
-        new_view.add_regions(key='regions_ascii', regions=regions_ascii, scope=color_ascii)
-        new_view.add_regions(key='regions_unicode', regions=regions_unicode, scope=color_unicode)
+        region = sc.get_sel_regions(self.view)[0]
+        sc.cancel_job(JOB_NAME)
+        output = _BinOutput(self.view.window(), settings, source=self.view)
+        sc.start_job(JOB_NAME, output.view, self.do_work(region, output, left_delim, right_delim))
+
+    def do_work(self, region, output, left_delim, right_delim):
+        try:
+            # Read each chunk once and let the engine find the binary chars.
+            for start in range(region.begin(), region.end(), TEXT_CHUNK_SIZE):
+                text = self.view.substr(sublime.Region(start, min(start + TEXT_CHUNK_SIZE, region.end())))
+                output.append(*bc.translate_text(text, left_delim, right_delim))
+                output.publish()
+                yield (start + len(text) - region.begin()) / len(region)
+
+            output.append('\n')
+        except GeneratorExit:
+            output.append('\n===== Cancelled =====\n')
+            raise
+        finally:
+            output.publish(True)
 
 
 #-----------------------------------------------------------------------------------
@@ -76,47 +71,61 @@ class SbotBinInstanceCommand(sublime_plugin.TextCommand):
 
         settings = sublime.load_settings(sc.get_settings_fn())
         output_limit = int(settings.get('output_limit'))   # pyright: ignore
-        color_ascii = str(settings.get('color_ascii'))
-        color_unicode = str(settings.get('color_unicode'))
-
-        in_pos = 0 # input text
-
-        buff = []
-        regions_ascii = []
-        regions_unicode = []
 
-        region = sc.get_sel_regions(self.view)[0] 
+        region = sc.get_sel_regions(self.view)[0]
+        sc.cancel_job(JOB_NAME)
+        output = _BinOutput(self.view.window(), settings, source=self.view)
+        sc.start_job(JOB_NAME, output.view, self.do_work(region, output, output_limit))
 
-        # Iterate lines in selection.
+    def do_work(self, region, output, output_limit):
         line_num = 1
-        for region_line in self.view.split_by_newlines(region):
-            col_num = 1
-
-            # Examine each line.
-            text = self.view.substr(region_line)
-            for ch in text:
-                if ch >= ' ' and ch <= '~': # ascii printable
-                    pass
-                elif ch in com_bin:
-                    buff.append(f'line:{line_num} col:{col_num} val:{com_bin[ch]}\n')
-                else: # Everything else is binary of interest.
-                    if ch < ' ':
-                        buff.append(f'line:{line_num} col:{col_num} val:0x{ord(ch):02X}\n')
-                    else:
-                        buff.append(f'line:{line_num} col:{col_num} val:U+{ord(ch):02X}\n')
-                    output_limit -= 1
-
-                col_num += 1
-                in_pos += 1
-
-            line_num += 1
-            if output_limit <= 0:
-                buff.append(f'===== Truncated =====\n')
-                break
-
-        new_view = sc.create_new_view(self.view.window(), ''.join(buff))
-        new_view.add_regions(key='regions_ascii', regions=regions_ascii, scope=color_ascii)
-        new_view.add_regions(key='regions_unicode', regions=regions_unicode, scope=color_unicode)
+        col_num = 1
+
+        try:
+            for start in range(region.begin(), region.end(), TEXT_CHUNK_SIZE):
+                text = self.view.substr(sublime.Region(start, min(start + TEXT_CHUNK_SIZE, region.end())))
+                found, line_num, col_num = bc.find_bin_chars(text, line_num, col_num)
+
+                buff = []
+                spans_ascii = []
+                spans_unicode = []
+                out_pos = 0 # in this chunk of output
+                truncated = False
+
+                for line, col, ch in found:
+                    if ch in bc.com_bin:
+                        sval = bc.com_bin[ch]
+                        spans = spans_ascii
+                    else: # Everything else is binary of interest.
+                        if ch < ' ':
+                            sval = f'0x{ord(ch):02X}'
+                            spans = spans_ascii
+                        else:
+                            sval = f'U+{ord(ch):02X}'
+                            spans = spans_unicode
+                        output_limit -= 1
+
+                    sline = f'line:{line} col:{col} val:'
+                    buff.append(f'{sline}{sval}\n')
+                    spans.append((out_pos + len(sline), out_pos + len(sline) + len(sval))) # color range
+                    out_pos += len(sline) + len(sval) + 1
+
+                    if output_limit <= 0:
+                        buff.append(f'===== Truncated =====\n')
+                        truncated = True
+                        break
+
+                output.append(''.join(buff), spans_ascii, spans_unicode)
+                output.publish()
+                if truncated:
+                    break
+                yield (start + len(text) - region.begin()) / len(region)
+
+        except GeneratorExit:
+            output.append('===== Cancelled =====\n')
+            raise
+        finally:
+            output.publish(True)
 
 
 #-----------------------------------------------------------------------------------
@@ -124,128 +133,368 @@ class SbotBinDumpCommand(sublime_plugin.WindowCommand):
 
     start_addr = 0 # -1 = invalid
     rows_to_read = 0 # num to read or 0 for all
-    out_pos = 0 # byte position for capturing regions
-    lsrow = [] # current row parts
+    paged = False # browse with mmap pages instead of one full dump
     last_input = ''
     fn = '' # source
 
-    def run(self, paths, sel_addr_range):
+    def run(self, paths, sel_addr_range, paged=False):
 
         # Reset.
         self.start_addr = 0
         self.rows_to_read = 0
-        self.out_pos = 0
+        self.paged = paged
         _, _, self.fn = sc.get_path_parts(self.window, paths)
 
         # User options?
         if sel_addr_range:
             self.window.show_input_panel('Enter: address [length]', self.last_input, self.on_user_entry, None, None)
         else:
-            self.do_work()
+            self.start_work()
 
     def on_user_entry(self, text):
-        # Reset.
-        self.start_addr = 0
-        self.rows_to_read = 0
-        self.out_pos = 0
-        # print('--!', text)
-
         # Process the user input. Address can be hex or decimal.
-        parts = text.upper().split(' ')
-        if len(parts) >= 1:
-            try:
-                if 'X' in parts[0]:
-                    self.start_addr = int(parts[0].replace('X', ''), 16)
-                else:
-                    self.start_addr = int(parts[0], 10)
-                if len(parts) == 2:
-                    self.rows_to_read = int(parts[1], 10)
-            except:
-                # print('--!', e)
-                self.start_addr = -1
-
-        if self.start_addr == -1:
+        addr_rows = _parse_addr(text)
+        if addr_rows is None:
             sc.error(f'Invalid address/rows')
             return
 
+        self.start_addr, self.rows_to_read = addr_rows
         self.last_input = text # save
-        self.do_work() # go
+        self.start_work() # go
 
-    def do_work(self):
-        ROW_SIZE = 16
-        buff = []
-        regions_ascii = []
-        regions_unicode = []
+    def start_work(self):
+        if self.paged:
+            self.do_paged()
+            return
 
         settings = sublime.load_settings(sc.get_settings_fn())
-        color_ascii = str(settings.get('color_ascii'))
-        color_unicode = str(settings.get('color_unicode'))
         output_limit = int(settings.get('output_limit'))   # pyright: ignore
 
-        # Helper func.
-        def append_row_element(s):
-            self.lsrow.append(s)
-            self.out_pos += len(s)
-
-        with open(str(self.fn), 'rb') as f:
-            eof = False
-            done = False
-            row_count = 0
-            f.seek(self.start_addr)
-
-            # Read rows.
-            while not done:
-                if (self.rows_to_read > 0 and row_count >= self.rows_to_read) or eof:
-                    done = True
-                    continue
-
-                self.lsrow.clear()
-                row_addr = f.tell() # cache
-                bytes = f.read(ROW_SIZE)
-                row_len = len(bytes)
-                eof = row_len < ROW_SIZE
-
-                ### Process row.
-                readable = ['    ']
-
-                # Address.
-                append_row_element(f'0x{row_addr:04X}')
-
-                # Byte values.
-                for i in range(0, row_len):
-                    start_pos = self.out_pos + 1
-                    v = bytes[i]
-                    append_row_element(f' {v:02X}')
-
-                    if v >= 32 and v <= 126: # ascii printable
-                        readable.append(chr(v))
-                    elif v < 32 or v == 127: # ascii control
-                        regions_ascii.append(sublime.Region(start_pos, self.out_pos)) # color range
-                        readable.append(' ')
-                    else: # Unicode byte.
-                        regions_unicode.append(sublime.Region(start_pos, self.out_pos)) # color range
-                        readable.append(' ')
-
-                # Maybe pad last row.
-                for i in range(row_len, ROW_SIZE):
-                    append_row_element(f' ..')
-
-                # Tack on readable.
-                append_row_element(''.join(readable))
-
-                # Row done.
-                append_row_element('\n')
-                buff.append(''.join(self.lsrow))
-
-                row_count += 1
-                output_limit -= 1
-
-                if output_limit <= 0:
-                    buff.append(f'====================== Truncated =====================\n')
-                    done = True
-                    break
+        sc.cancel_job(JOB_NAME)
+        output = _BinOutput(self.window, settings, gap=1)
+        sc.start_job(JOB_NAME, output.view, self.do_work(str(self.fn), self.start_addr, self.rows_to_read, output, output_limit))
+
+    def do_work(self, fn, start_addr, rows_to_read, output, output_limit):
+        # Total rows we expect to show, for progress.
+        total_rows = (max(os.path.getsize(fn) - start_addr, 0) + ROW_SIZE - 1) // ROW_SIZE
+        if rows_to_read > 0:
+            total_rows = min(total_rows, rows_to_read)
+        if output_limit > 0:
+            total_rows = min(total_rows, output_limit)
+
+        try:
+            with open(fn, 'rb') as f:
+                row_count = 0
+                addr = start_addr
+                f.seek(addr)
+
+                # Read blocks of rows.
+                while True:
+                    to_read = CHUNK_SIZE
+                    if rows_to_read > 0:
+                        to_read = min(to_read, (rows_to_read - row_count) * ROW_SIZE)
+                    if output_limit > 0:
+                        to_read = min(to_read, (output_limit - row_count) * ROW_SIZE)
+                    if to_read <= 0:
+                        if output_limit > 0 and row_count >= output_limit and f.read(1):
+                            output.append(f'====================== Truncated =====================\n')
+                        break
+
+                    data = f.read(to_read)
+                    if len(data) == 0:
+                        break
+
+                    output.append(*bc.format_block(data, addr))
+                    output.publish()
+
+                    addr += len(data)
+                    row_count += (len(data) + ROW_SIZE - 1) // ROW_SIZE
+                    yield row_count / max(total_rows, 1)
+
+        except GeneratorExit:
+            output.append('===== Cancelled =====\n')
+            raise
+        finally:
+            output.publish(True)
+
+    def do_paged(self):
+        settings = sublime.load_settings(sc.get_settings_fn())
+        page_rows = int(settings.get('dump_page_rows', 256))   # pyright: ignore
+
+        try:
+            pager = _DumpPager(str(self.fn), page_rows)
+        except Exception as e:
+            sc.error(f'Can\'t page {self.fn}: {e}', e.__traceback__)
+            return
+
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name(f'Dump {self.fn}')
+        _pagers[view.id()] = pager
+        view.run_command('sbot_bin_dump_page', {'how': 'goto', 'addr': self.start_addr})
+
+
+#-----------------------------------------------------------------------------------
+class SbotBinDumpPageCommand(sublime_plugin.TextCommand):
+    '''sbot_bin_dump_page how=next|prev|first|last|goto|scroll. Moves a paged dump view.'''
+
+    def run(self, edit, how='next', addr=None, rows=0):
+        pager = _pagers.get(self.view.id())
+        if pager is None:
+            return
+
+        page_len = pager.rows * ROW_SIZE
+
+        if how == 'next':
+            start = pager.page_addr + page_len
+        elif how == 'prev':
+            start = pager.page_addr - page_len
+        elif how == 'first':
+            start = 0
+        elif how == 'last':
+            start = pager.size - page_len
+        elif how == 'scroll':
+            start = pager.page_addr + rows * ROW_SIZE
+        elif addr is None: # goto - ask user
+            win = self.view.window()
+            if win is not None:
+                win.show_input_panel('Enter: address', '', self.on_user_entry, None, None)
+            return
+        else: # goto
+            start = addr
+
+        prev_addr = pager.page_addr
+        pager.move_to(start)
+
+        # Where the caret goes after - the address for goto, the same bytes for scroll, else the top.
+        row, col = 0, 0
+        if how == 'goto':
+            row = (max(start, 0) - pager.page_addr) // ROW_SIZE
+        elif how == 'scroll' and len(self.view.sel()) > 0:
+            row, col = self.view.rowcol(self.view.sel()[0].b)
+            row -= (pager.page_addr - prev_addr) // ROW_SIZE
+        row = min(max(row, 0), (pager.page_end - pager.page_addr - 1) // ROW_SIZE)
+
+        # Render current page.
+        settings = sublime.load_settings(sc.get_settings_fn())
+        text, spans_ascii, spans_unicode = bc.format_block(pager.page(), pager.page_addr)
+        regions_ascii = _region_builder(settings, gap=1)
+        regions_unicode = _region_builder(settings, gap=1)
+        regions_ascii.add_spans(spans_ascii)
+        regions_unicode.add_spans(spans_unicode)
+
+        # The selection events from this are ours, not the user reaching an edge.
+        pager.rendering = True
+        self.view.set_read_only(False)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), text)
+        self.view.set_read_only(True)
+        pager.caret = self.view.text_point(row, col)
+        self.view.sel().clear()
+        self.view.sel().add(pager.caret)
+        pager.rendering = False
+        _add_regions(self.view, settings, regions_ascii.regions(), regions_unicode.regions())
+        if regions_ascii.truncated or regions_unicode.truncated:
+            sc.info(f'Too many binary regions - only the first {settings.get("max_regions")} are colored')
+        self.view.set_status('bin_dump', f'0x{pager.page_addr:04X}-0x{pager.page_end:04X} of 0x{pager.size:04X}')
+
+    def on_user_entry(self, text):
+        addr_rows = _parse_addr(text)
+        if addr_rows is None:
+            sc.error(f'Invalid address')
+            return
+        self.view.run_command('sbot_bin_dump_page', {'how': 'goto', 'addr': addr_rows[0]})
+
+    def is_enabled(self):
+        return self.view.id() in _pagers
+
 
-        # Show result.
-        new_view = sc.create_new_view(self.window, ''.join(buff))
-        new_view.add_regions(key='regions_ascii', regions=regions_ascii, scope=color_ascii)
-        new_view.add_regions(key='regions_unicode', regions=regions_unicode, scope=color_unicode)
+#-----------------------------------------------------------------------------------
+class SbotBinCancelCommand(sublime_plugin.WindowCommand):
+    ''' Stop the running bin command. '''
+
+    def run(self):
+        sc.cancel_job(JOB_NAME)
+
+    def is_enabled(self):
+        return sc.is_job_running(JOB_NAME)
+
+
+#-----------------------------------------------------------------------------------
+class SbotBinDumpPageEvent(sublime_plugin.EventListener):
+    ''' Fetches adjacent pages when the caret or viewport reaches the edge of a paged dump. '''
+
+    _polling = set() # view ids with a live viewport watcher
+
+    def on_selection_modified_async(self, view):
+        pager = _pagers.get(view.id())
+        if pager is None or pager.rendering or len(view.sel()) != 1:
+            return
+        # Still where the last render put it. This runs later so the flag alone isn't enough.
+        if view.sel()[0].b == pager.caret:
+            return
+
+        # Shift by half a page. The render keeps the caret on the same bytes so it doesn't bounce back.
+        row = view.rowcol(view.sel()[0].b)[0]
+        shift = self._edge_shift(view, pager, row)
+        if shift != 0:
+            self._scroll(view, pager, shift)
+            view.show(view.sel()[0])
+
+    def on_activated_async(self, view):
+        if view.id() in _pagers and view.id() not in self._polling:
+            self._polling.add(view.id())
+            self._poll_viewport(view)
+
+    def on_close(self, view):
+        pager = _pagers.pop(view.id(), None)
+        if pager is not None:
+            pager.close()
+
+    def _poll_viewport(self, view):
+        ''' There is no scroll event so watch the viewport while the view is active. '''
+        pager = _pagers.get(view.id())
+        win = view.window()
+        if pager is None or win is None or win.active_view() != view:
+            self._polling.discard(view.id())
+            return
+
+        # Only when the page is taller than the viewport, otherwise it would bounce.
+        vis = view.visible_region()
+        top_row = view.rowcol(vis.a)[0]
+        bottom_row = view.rowcol(vis.b)[0]
+        last_row = view.rowcol(view.size())[0] - 1
+        shift = 0
+        if top_row > 0 and bottom_row >= last_row:
+            shift = self._edge_shift(view, pager, bottom_row)
+        elif top_row == 0 and bottom_row < last_row:
+            shift = self._edge_shift(view, pager, top_row)
+
+        if shift != 0:
+            shift = self._scroll(view, pager, shift)
+            view.set_viewport_position((0, (top_row - shift) * view.line_height()), False)
+
+        sublime.set_timeout_async(lambda: self._poll_viewport(view), 250)
+
+    def _scroll(self, view, pager, rows):
+        ''' Move the page. Returns the rows actually moved as the end of file may clamp it. '''
+        prev_addr = pager.page_addr
+        view.run_command('sbot_bin_dump_page', {'how': 'scroll', 'rows': rows})
+        return (pager.page_addr - prev_addr) // ROW_SIZE
+
+    def _edge_shift(self, view, pager, row):
+        ''' Rows to move the page by if row is at an edge, else 0. '''
+        last_row = view.rowcol(view.size())[0] - 1 # text ends with LF
+        half = max(pager.rows // 2, 1)
+        if row >= last_row and pager.page_end < pager.size:
+            return half
+        if row <= 0 and pager.page_addr > 0:
+            return -min(half, pager.page_addr // ROW_SIZE)
+        return 0
+
+
+#-----------------------------------------------------------------------------------
+class _DumpPager(object):
+    ''' Window of rows onto a file mapped with mmap. '''
+
+    def __init__(self, fn, rows):
+        self.rows = max(rows, 1)
+        self.page_addr = 0
+        self.rendering = False
+        self.caret = None # where the last render put it
+        self._file = open(fn, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self.size = len(self._mm)
+
+    @property
+    def page_end(self):
+        return min(self.page_addr + self.rows * ROW_SIZE, self.size)
+
+    def move_to(self, addr):
+        ''' Set page start, aligned to a row and clamped to the file. '''
+        last = max(self.size - 1, 0) // ROW_SIZE * ROW_SIZE
+        self.page_addr = min(max(addr, 0) // ROW_SIZE * ROW_SIZE, last)
+
+    def page(self):
+        return self._mm[self.page_addr:self.page_end]
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+#-----------------------------------------------------------------------------------
+class _BinOutput(object):
+    ''' Output view being filled in chunks by a bin job, plus its colors. '''
+
+    def __init__(self, window, settings, gap=0, source=None):
+        self.settings = settings
+        self.sink = sc.open_output(window, source=source)
+        self.view = self.sink.view
+        self.regions_ascii = _region_builder(settings, gap)
+        self.regions_unicode = _region_builder(settings, gap)
+        self._region_count = 0
+        self._color_time = time.monotonic()
+
+    def append(self, text, spans_ascii=(), spans_unicode=()):
+        ''' Add text. Spans are (start, end) relative to text. '''
+        self.regions_ascii.add_spans(spans_ascii, self.sink.size)
+        self.regions_unicode.add_spans(spans_unicode, self.sink.size)
+        self.sink.write(text)
+
+    def publish(self, final=False):
+        '''
+        Show what we have so far. Coloring costs all the regions every time so until final it's only
+        done every COLOR_INTERVAL, and skipped if nothing changed. Does nothing if the view has been reused.
+        '''
+        self.sink.flush()
+        if self.sink.stale:
+            return
+        if not final and time.monotonic() - self._color_time < COLOR_INTERVAL:
+            return
+
+        # Runs are left open until final so they can carry on into the next chunk.
+        regions_ascii = self.regions_ascii.regions(final)
+        regions_unicode = self.regions_unicode.regions(final)
+        count = len(regions_ascii) + len(regions_unicode)
+        if count != self._region_count or final:
+            _add_regions(self.view, self.settings, regions_ascii, regions_unicode)
+            self._region_count = count
+        self._color_time = time.monotonic()
+
+        if final and (self.regions_ascii.truncated or self.regions_unicode.truncated):
+            sc.info(f'Too many binary regions - only the first {self.settings.get("max_regions")} are colored')
+
+
+#-----------------------------------------------------------------------------------
+def _add_regions(view, settings, regions_ascii, regions_unicode):
+    '''Color the output.'''
+    view.add_regions(key='regions_ascii', regions=regions_ascii, scope=str(settings.get('color_ascii')))
+    view.add_regions(key='regions_unicode', regions=regions_unicode, scope=str(settings.get('color_unicode')))
+
+
+#-----------------------------------------------------------------------------------
+def _region_builder(settings, gap=0):
+    '''Region builder for one color. Dump output wants gap=1 to join the hex values either side of a space.'''
+    return sc.RegionBuilder(gap, int(settings.get('max_regions', 50000)))   # pyright: ignore
+
+
+#-----------------------------------------------------------------------------------
+def _parse_addr(text):
+    '''Parse user entry "address [rows]". Address can be hex or decimal. Returns (addr, rows) or None if invalid.'''
+    addr = 0
+    rows = 0
+    parts = text.upper().split(' ')
+    try:
+        if 'X' in parts[0]:
+            addr = int(parts[0].replace('X', ''), 16)
+        else:
+            addr = int(parts[0], 10)
+        if len(parts) == 2:
+            rows = int(parts[1], 10)
+    except:
+        return None
+    return (addr, rows)
@@ -0,0 +1,136 @@
+import re
+import itertools
+
+
+# Char finding and dump row formatting for binstr.py. tests/bench_bin_dump.py loads this file on its own so keep sublime out of it.
+
+
+# Expected/common binary chars.
+com_bin = { '\0':'NUL', '\n':'LF', '\r':'CR', '\t':'TAB', '\033':'ESC' }
+
+# Bytes per dump row.
+ROW_SIZE = 16
+
+# Readable column: printable ascii passes through, everything else is blank.
+_READABLE = bytes(b if 32 <= b <= 126 else 32 for b in range(256))
+
+# Byte classes that get colored.
+_RE_ASCII_CTRL = re.compile(rb'[\x00-\x1f\x7f]+')
+_RE_UNICODE_BYTE = re.compile(rb'[\x80-\xff]+')
+
+# Runs of chars that translate expands. Everything except printable ascii and the LF line ends.
+_RE_BIN_CHARS = re.compile(r'[^ -~\n]+')
+
+
+#-----------------------------------------------------------------------------------
+def format_block(data, addr):
+    '''
+    Format a chunk of bytes as dump rows starting at addr using bulk operations.
+    Returns (text, spans_ascii, spans_unicode) where spans are (start, end) offsets into text
+    covering each run of control/non-ascii bytes in the hex column.
+    '''
+    dlen = len(data)
+    shex = data.hex(' ').upper()
+    sreadable = data.translate(_READABLE).decode('ascii')
+
+    # Columns for all rows. Hex rows are fixed width, 3 chars per byte less the trailing space.
+    saddrs = [f'0x{a:04X} ' for a in range(addr, addr + dlen, ROW_SIZE)]
+    shexs = [shex[i:i + ROW_SIZE * 3 - 1] for i in range(0, dlen * 3, ROW_SIZE * 3)]
+    sreads = [sreadable[i:i + ROW_SIZE] for i in range(0, dlen, ROW_SIZE)]
+
+    # Maybe pad last row.
+    if dlen % ROW_SIZE:
+        shexs[-1] += ' ..' * (ROW_SIZE - dlen % ROW_SIZE)
+
+    # Where each row's hex column starts in text.
+    row_lens = [len(sa) + ROW_SIZE * 3 + 3 + len(sr) + 1 for sa, sr in zip(saddrs, sreads)]
+    hex_offsets = [start + len(sa) for start, sa in zip(itertools.accumulate([0] + row_lens), saddrs)]
+
+    def spans(rex):
+        # Map each run to the hex column, splitting at row boundaries.
+        ret = []
+        for m in rex.finditer(data):
+            start, end = m.span()
+            row = start // ROW_SIZE
+            last_row = (end - 1) // ROW_SIZE
+            if row == last_row: # usual case
+                hpos = hex_offsets[row] - row * ROW_SIZE * 3
+                ret.append((hpos + start * 3, hpos + end * 3 - 1))
+            else:
+                while start < end:
+                    row = start // ROW_SIZE
+                    row_end = min(end, (row + 1) * ROW_SIZE)
+                    hpos = hex_offsets[row] - row * ROW_SIZE * 3
+                    ret.append((hpos + start * 3, hpos + row_end * 3 - 1))
+                    start = row_end
+        return ret
+
+    text = ''.join([f'{sa}{sh}    {sr}\n' for sa, sh, sr in zip(saddrs, shexs, sreads)])
+    return (text, spans(_RE_ASCII_CTRL), spans(_RE_UNICODE_BYTE))
+
+
+#-----------------------------------------------------------------------------------
+def translate_text(text, left_delim, right_delim):
+    '''
+    Expand the binary/unicode chars in text. Printable runs are copied as whole slices so the cost
+    is in the number of binary chars rather than the text size.
+    Returns (text, spans_ascii, spans_unicode) where spans are (start, end) offsets into text.
+    '''
+    parts = []
+    spans_ascii = []
+    spans_unicode = []
+    out_pos = 0
+    last = 0
+
+    for m in _RE_BIN_CHARS.finditer(text):
+        start, end = m.span()
+        if start > last: # printable run
+            parts.append(text[last:start])
+            out_pos += start - last
+        last = end
+
+        for ch in m.group():
+            if ch in com_bin:
+                sout = com_bin[ch]
+                spans = spans_ascii
+            elif ch < ' ':
+                sout = f'{left_delim}0x{ord(ch):02X}{right_delim}'
+                spans = spans_ascii
+            else:
+                sout = f'{left_delim}U+{ord(ch):04X}{right_delim}'
+                spans = spans_unicode
+            parts.append(sout)
+            spans.append((out_pos, out_pos + len(sout)))
+            out_pos += len(sout)
+
+    parts.append(text[last:])
+    return (''.join(parts), spans_ascii, spans_unicode)
+
+
+#-----------------------------------------------------------------------------------
+def find_bin_chars(text, line_num=1, col_num=1):
+    '''
+    Locate the binary/unicode chars in text. line_num/col_num are where text starts, for feeding it in chunks.
+    Returns (found, line_num, col_num) where found is a list of (line, col, ch) and line/col are where text ends.
+    '''
+    found = []
+    last = 0
+    line_start = -col_num + 1 # pos of first char on current line, relative to text
+
+    for m in _RE_BIN_CHARS.finditer(text):
+        start, end = m.span()
+        nls = text.count('\n', last, start)
+        if nls > 0:
+            line_num += nls
+            line_start = text.rfind('\n', last, start) + 1
+        last = end
+
+        for i, ch in enumerate(m.group()):
+            found.append((line_num, start + i - line_start + 1, ch))
+
+    nls = text.count('\n', last)
+    if nls > 0:
+        line_num += nls
+        line_start = text.rfind('\n', last) + 1
+
+    return (found, line_num, len(text) - line_start + 1)
@@ -13,20 +13,58 @@ import sublime_plugin
 from . import sbot_common as sc
 
 
+# More than this many changes in a region are applied as one replace.
+MAX_EDITS = 10000
+
+# Hidden regions covering text changed since the last save.
+TOUCHED_KEY = 'sbot_touched'
+
+
+#-----------------------------------------------------------------------------------
+def _normalize_sub(m):
+    '''Callable form of the normalize sub for the fused regexes that include it.'''
+    return m.group(1) * 2 if m.group(1) is not None else ''
+
+
+# The clean operations as (regex, sub), by the names used in sbot_clean_pipeline.
+_OPS = {
+    'trim:leading': (re.compile('^[ \t]+', re.MULTILINE), ''),
+    'trim:trailing': (re.compile('[\t ]+$', re.MULTILINE), ''),
+    'trim:both': (re.compile('^[ \t]+|[\t ]+$', re.MULTILINE), ''),
+    'remove_empty_lines:normalize': (re.compile(r'(?:\s*)(\r?\n)(?:\s*)(?:\r?\n+)', re.MULTILINE), r'\1\1'),
+    'remove_empty_lines:remove_all': (re.compile('^[ \t]*$\r?\n', re.MULTILINE), ''),
+    # Note: doesn't trim trailing.
+    'remove_ws:normalize': (re.compile('([ ])[ ]+'), r'\1'),
+    'remove_ws:keep_eol': (re.compile(r'[ \t\v\f]'), ''),
+    'remove_ws:remove_all': (re.compile(r'[ \t\r\n\v\f]'), ''),
+}
+
+# Pairs of ops that can be done in one pass. Each one must give the same result as running the two in order
+# with reo.sub() - compare them on mixed blank/whitespace/CRLF text before adding one.
+_FUSED = {
+    ('trim:leading', 'trim:trailing'): _OPS['trim:both'],
+    ('trim:trailing', 'trim:leading'): _OPS['trim:both'],
+    ('trim:leading', 'remove_empty_lines:remove_all'): (re.compile('^[ \t]*$\r?\n|^[ \t]+', re.MULTILINE), ''),
+    ('trim:trailing', 'remove_empty_lines:remove_all'): (re.compile('^[ \t]*$\r?\n|[\t ]+$', re.MULTILINE), ''),
+    ('trim:both', 'remove_empty_lines:remove_all'): (re.compile('^[ \t]*$\r?\n|^[ \t]+|[\t ]+$', re.MULTILINE), ''),
+    ('remove_empty_lines:remove_all', 'trim:trailing'): (re.compile('^[ \t]*$\r?\n|[\t ]+$', re.MULTILINE), ''),
+    ('remove_empty_lines:remove_all', 'trim:both'): (re.compile('^[ \t]*$\r?\n|^[ \t]+|[\t ]+$', re.MULTILINE), ''),
+    ('trim:leading', 'remove_empty_lines:normalize'):
+        (re.compile(r'(?:\s*)(\r?\n)(?:\s*)(?:\r?\n+)|^[ \t]+', re.MULTILINE), _normalize_sub),
+    ('trim:trailing', 'remove_empty_lines:normalize'):
+        (re.compile(r'(?:\s*)(\r?\n)(?:\s*)(?:\r?\n+)|[\t ]+$', re.MULTILINE), _normalize_sub),
+    ('trim:both', 'remove_empty_lines:normalize'):
+        (re.compile(r'(?:\s*)(\r?\n)(?:\s*)(?:\r?\n+)|^[ \t]+|[\t ]+$', re.MULTILINE), _normalize_sub),
+    ('remove_ws:keep_eol', 'remove_empty_lines:remove_all'): (re.compile('^[ \t\v\f]*$\r?\n|[ \t\v\f]', re.MULTILINE), ''),
+}
+
+
 #-----------------------------------------------------------------------------------
 class SbotTrimCommand(sublime_plugin.TextCommand):
     '''sbot_trim how=leading|trailing|both'''
 
     def run(self, edit, how):
-        if how == 'leading':
-            reo = re.compile('^[ \t]+', re.MULTILINE)
-            sub = ''
-        elif how == 'trailing':
-            reo = re.compile('[\t ]+$', re.MULTILINE)
-            sub = ''
-        else:  # both
-            reo = re.compile('^[ \t]+|[\t ]+$', re.MULTILINE)
-            sub = ''
+        reo, sub = _OPS.get(f'trim:{how}', _OPS['trim:both'])
         _do_sub(self.view, edit, reo, sub)
 
 
@@ -35,12 +73,7 @@ class SbotRemoveEmptyLinesCommand(sublime_plugin.TextCommand):
     '''sbot_remove_empty_lines  how=remove_all|normalize'''
 
     def run(self, edit, how):
-        if how == 'normalize':
-            reo = re.compile(r'(?:\s*)(\r?\n)(?:\s*)(?:\r?\n+)', re.MULTILINE)
-            sub = r'\1\1'
-        else:  # remove_all
-            reo = re.compile('^[ \t]*$\r?\n', re.MULTILINE)
-            sub = ''
+        reo, sub = _OPS.get(f'remove_empty_lines:{how}', _OPS['remove_empty_lines:remove_all'])
         _do_sub(self.view, edit, reo, sub)
 
 
@@ -49,23 +82,189 @@ class SbotRemoveWsCommand(sublime_plugin.TextCommand):
     '''sbot_remove_ws  how=remove_all|keep_eol|normalize'''
 
     def run(self, edit, how):
-        if how == 'normalize':
-            # Note: doesn't trim trailing.
-            reo = re.compile('([ ])[ ]+')
-            sub = r'\1'
-        elif how == 'keep_eol':
-            reo = re.compile(r'[ \t\v\f]')
-            sub = ''
-        else:  # remove_all
-            reo = re.compile(r'[ \t\r\n\v\f]')
-            sub = ''
+        reo, sub = _OPS.get(f'remove_ws:{how}', _OPS['remove_ws:remove_all'])
         _do_sub(self.view, edit, reo, sub)
 
 
 #-----------------------------------------------------------------------------------
-def _do_sub(view, edit, reo, sub):
-    # Generic substitution function.
-    for region in sc.get_sel_regions(view):
+class SbotCleanPipelineCommand(sublime_plugin.TextCommand):
+    '''
+    sbot_clean_pipeline ops=["trim:trailing", "remove_empty_lines:normalize", ...]
+    Runs several clean ops in order but reads and writes the text once. Known pairs are fused into one regex.
+    '''
+
+    def run(self, edit, ops=None):
+        if ops is None:
+            settings = sublime.load_settings(sc.get_settings_fn())
+            ops = settings.get('clean_pipeline')
+
+        bad = [op for op in ops if op not in _OPS]
+        if len(bad) > 0:
+            sc.error(f'Invalid clean op: {", ".join(bad)}')
+            return
+
+        stages = _compile_pipeline(ops)
+
+        if len(stages) == 1:
+            reo, sub = stages[0]
+            _do_sub(self.view, edit, reo, sub)
+        elif len(stages) > 1:
+            # Run them in memory then write back only the part that changed.
+            for region in sorted(sc.get_sel_regions(self.view), key=lambda r: r.begin(), reverse=True):
+                orig = self.view.substr(region)
+                new = orig
+                for reo, sub in stages:
+                    new = reo.sub(sub, new)
+                _replace_changed(self.view, edit, region, orig, new)
+
+
+#-----------------------------------------------------------------------------------
+class SbotTrimTouchedCommand(sublime_plugin.TextCommand):
+    '''Internal: trim trailing ws on the lines changed since the last save.'''
+
+    def run(self, edit):
+        lines = {}
+        for region in self.view.get_regions(TOUCHED_KEY):
+            for line in self.view.lines(region):
+                lines[line.begin()] = line
+        reo, sub = _OPS['trim:trailing']
+        _do_sub(self.view, edit, reo, sub, list(lines.values()))
+
+
+#-----------------------------------------------------------------------------------
+class SbotTouchedListener(sublime_plugin.TextChangeListener):
+    '''Remembers where the buffer was changed, as hidden regions so ST keeps them up to date for us.'''
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        del buffer
+        settings = sublime.load_settings(sc.get_settings_fn())
+        return bool(settings.get('trim_on_save'))
+
+    def on_text_changed(self, changes):
+        view = self.buffer.primary_view()
+        if view is None or view.is_scratch(): # never saved
+            return
+
+        # Each change is positioned in the text as it was at the time so earlier ones get moved by later ones.
+        spans = []
+        for change in changes:
+            spans = sc.apply_text_change(spans, change.a.pt, change.b.pt, len(change.str))
+
+        # Merged so typing in the same places doesn't keep growing the list.
+        regions = view.get_regions(TOUCHED_KEY)
+        regions.extend(sublime.Region(start, end) for start, end in spans)
+        view.add_regions(TOUCHED_KEY, sc.merge_regions(regions), flags=sublime.HIDDEN)
+
+
+#-----------------------------------------------------------------------------------
+class SbotTrimOnSaveEvent(sublime_plugin.EventListener):
+    '''Trim the touched lines before saving.'''
+
+    def on_pre_save(self, view):
+        settings = sublime.load_settings(sc.get_settings_fn())
+        if not settings.get('trim_on_save'):
+            return
+
+        view = view.buffer().primary_view()
+        syntax = view.syntax()
+        max_size = int(settings.get('trim_on_save_max_size'))  # pyright: ignore
+
+        if syntax is not None and syntax.name in settings.get('trim_on_save_ignore'):  # pyright: ignore
+            pass
+        elif max_size > 0 and view.size() > max_size:
+            pass
+        elif len(view.get_regions(TOUCHED_KEY)) > 0:
+            view.run_command('sbot_trim_touched')
+
+        # Start again.
+        view.erase_regions(TOUCHED_KEY)
+
+
+#-----------------------------------------------------------------------------------
+def _compile_pipeline(ops):
+    '''Turn a list of op names into a list of (regex, sub) stages, fusing adjacent pairs where we can.'''
+    stages = []
+    i = 0
+    while i < len(ops):
+        pair = tuple(ops[i:i + 2])
+        if pair in _FUSED:
+            stages.append(_FUSED[pair])
+            i += 2
+        else:
+            stages.append(_OPS[ops[i]])
+            i += 1
+    return stages
+
+
+#-----------------------------------------------------------------------------------
+def _replace_changed(view, edit, region, orig, new):
+    '''Replace region, which contains orig, with new but leave the unchanged head and tail alone.'''
+    if orig == new:
+        return
+
+    # Compare in blocks first, it's a lot quicker than char by char.
+    block = 4096
+    head = 0
+    limit = min(len(orig), len(new))
+    while head + block <= limit and orig[head:head + block] == new[head:head + block]:
+        head += block
+    while head < limit and orig[head] == new[head]:
+        head += 1
+
+    tail = 0
+    limit -= head
+    while tail + block <= limit and orig[len(orig) - tail - block:len(orig) - tail] == new[len(new) - tail - block:len(new) - tail]:
+        tail += block
+    while tail < limit and orig[len(orig) - tail - 1] == new[len(new) - tail - 1]:
+        tail += 1
+
+    view.replace(edit, sublime.Region(region.begin() + head, region.end() - tail), new[head:len(new) - tail])
+
+
+#-----------------------------------------------------------------------------------
+def _do_sub(view, edit, reo, sub, regions=None):
+    '''
+    Generic substitution function. Only the text that actually changes is replaced so a mostly clean
+    file doesn't get swapped out wholesale, which is slow and makes a huge undo entry.
+    Works on the selection or whole view unless regions are given.
+    '''
+    if regions is None:
+        regions = sc.get_sel_regions(view)
+
+    # Last region first so earlier positions stay valid.
+    for region in sorted(regions, key=lambda r: r.begin(), reverse=True):
         orig = view.substr(region)
-        new = reo.sub(sub, orig)
-        view.replace(edit, region, new)
+        edits = _find_edits(orig, reo, sub)
+        if len(edits) == 0:
+            continue
+
+        if len(edits) > MAX_EDITS:
+            # Lots of little edits cost more than one big one. Replace the span that covers them.
+            start = edits[0][0]
+            end = edits[-1][1]
+            parts = []
+            last = start
+            for estart, eend, enew in edits:
+                parts.append(orig[last:estart])
+                parts.append(enew)
+                last = eend
+            new = ''.join(parts)
+            view.replace(edit, sublime.Region(region.begin() + start, region.begin() + end), new)
+        else:
+            for start, end, new in reversed(edits):
+                view.replace(edit, sublime.Region(region.begin() + start, region.begin() + end), new)
+
+
+#-----------------------------------------------------------------------------------
+def _find_edits(text, reo, sub):
+    '''
+    What reo.sub(sub, text) would change, as a list of (start, end, new) in order. Matches that
+    would be replaced by the same text are skipped. sub is a template str or a function of the match.
+    '''
+    edits = []
+    for m in reo.finditer(text):
+        new = sub(m) if callable(sub) else m.expand(sub)
+        if new != m.group():
+            edits.append((m.start(), m.end(), new))
+    return edits
@@ -61,6 +61,7 @@ class SbotCopyFileCommand(sublime_plugin.WindowCommand):
                 newfn = f'{root}_{i}{ext}'
                 if not os.path.isfile(newfn):
                     shutil.copyfile(path, newfn)
+                    sc.clear_path_cache()
                     ok = True
                     break
 
@@ -82,6 +83,7 @@ class SbotDeleteFileCommand(sublime_plugin.WindowCommand):
         _, fn, path = sc.get_path_parts(self.window, None)
         if fn is not None:
             self.window.run_command("delete_file", {"files": [path], "prompt": False})
+            sc.clear_path_cache()
 
     def is_visible(self):  #, paths=None):
         _, fn, _ = sc.get_path_parts(self.window, None)
@@ -1,5 +1,7 @@
 import sys
 import os
+import multiprocessing
+import concurrent.futures
 import subprocess
 import shutil
 import string
@@ -11,6 +13,7 @@ import xml.dom.minidom
 import sublime
 import sublime_plugin
 from . import sbot_common as sc
+from . import format_core as fc
 
 
 # Syntax defs.
@@ -21,6 +24,9 @@ SYNTAX_XML = 'Packages/XML/XML.sublime-syntax'
 SYNTAX_LUA = 'Packages/Lua/Lua.sublime-syntax'
 SYNTAX_JSON = 'Packages/JSON/JSON.sublime-syntax'
 
+# Formatter results. Created on first use.
+_cache = None
+
 
 #-----------------------------------------------------------------------------------
 class SbotFormatXmlCommand(sublime_plugin.TextCommand):
@@ -33,34 +39,58 @@ class SbotFormatXmlCommand(sublime_plugin.TextCommand):
 
     def run(self, edit):
         del edit
-        err = False
 
         settings = sublime.load_settings(sc.get_settings_fn())
         reg = sc.get_sel_regions(self.view)[0]
-        s = self.view.substr(reg)
         tab_size = settings.get('format_tab_size')
 
-        def clean(node):
-            for n in node.childNodes:
-                if n.nodeType == xml.dom.minidom.Node.TEXT_NODE:
-                    if n.nodeValue:
-                        n.nodeValue = n.nodeValue.strip()
-                elif n.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
-                    clean(n)
+        syntax = str(self.view.settings().get('syntax'))
+
+        # Stream it through in the background, input and output, so big documents don't need it all in memory.
+        sink = sc.open_output(self.view.window(), source=self.view)
+        sc.start_job('Format', sink.view, self.do_work(reg, tab_size, syntax, sink))
+
+    def do_work(self, reg, tab_size, syntax, sink):
+        def chunks():
+            for start in range(reg.begin(), reg.end(), fc.XML_CHUNK_SIZE):
+                yield self.view.substr(sublime.Region(start, min(start + fc.XML_CHUNK_SIZE, reg.end())))
+
+        # Seen it before?
+        cache = _get_cache()
+        key = cache.make_key(chunks(), 'xml', tab_size, syntax)
+        sout = cache.get(key)
+        if sout is not None:
+            sink.write(sout)
+            sink.flush()
+            sink.view.set_syntax_file(SYNTAX_XML)
+            return
+
+        # Keep a copy for the cache unless it gets too big.
+        keep = []
+        keep_len = 0
+
+        def write(s):
+            nonlocal keep_len
+            sink.write(s)
+            if keep_len <= cache.mem_size:
+                keep.append(s)
+                keep_len += len(s)
 
         try:
-            top = xml.dom.minidom.parseString(s)
-            clean(top)
-            top.normalize()
-            sindent = ' ' * int(tab_size)  # pyright: ignore
-            s = top.toprettyxml(indent=sindent)
+            formatter = fc.XmlFormatter(tab_size, write)
+            for start, chunk in zip(range(reg.begin(), reg.end(), fc.XML_CHUNK_SIZE), chunks()):
+                formatter.feed(chunk)
+                sink.flush()
+                yield (start - reg.begin()) / len(reg)
+            formatter.close()
+            sink.flush()
+            sink.view.set_syntax_file(SYNTAX_XML)
+            if keep_len <= cache.mem_size:
+                cache.put(key, ''.join(keep))
         except Exception as e:
-            s = f"Error: {e}"
-            err = True
-
-        vnew = sc.create_new_view(self.view.window(), s)
-        if not err:
-            vnew.set_syntax_file(SYNTAX_XML)
+            sink.write(f"\nError: {e}\n")
+        finally:
+            sink.flush()
 
 
 #-----------------------------------------------------------------------------------
@@ -81,17 +111,7 @@ class SbotFormatCxCommand(sublime_plugin.TextCommand):
         s = self.view.substr(reg)
         tab_size = settings.get('format_tab_size')
 
-        # Build the command. Uses --style=allman --indent=spaces=4 --indent-col1-comments --errors-to-stdout
-        sindent = f'-s{tab_size}'
-        p = ['astyle', '-A1', sindent, '-Y', '-X']
-        if syntax == 'C#': # else default of C
-            p.append('--mode=cs')
-
-        try:
-            cp = subprocess.run(p, input=s, text=True, universal_newlines=True, capture_output=True, shell=True, check=True)
-            sout = cp.stdout
-        except Exception:
-            sout = "Format Cx failed. Is astyle installed and in your path?"
+        sout, _ = _cached_format(s, 'cx', tab_size, syntax, fc.format_cx, syntax == SYNTAX_CS)
 
         vnew = sc.create_new_view(self.view.window(), sout)
         vnew.set_syntax_file(syntax)
@@ -108,142 +128,136 @@ class SbotFormatJsonCommand(sublime_plugin.TextCommand):
 
     def run(self, edit):
         del edit
-        err = False
 
+        settings = sublime.load_settings(sc.get_settings_fn())
         reg = sc.get_sel_regions(self.view)[0]
         s = self.view.substr(reg)
+        tab_size = settings.get('format_tab_size')
 
-        class ScanState(enum.IntFlag):
-            DEFAULT = enum.auto()   # Idle
-            STRING = enum.auto()    # Process a quoted string
-            LCOMMENT = enum.auto()  # Processing a single line comment
-            BCOMMENT = enum.auto()  # Processing a block/multiline comment
-            DONE = enum.auto()      # Finito
+        syntax = str(self.view.settings().get('syntax'))
 
-        settings = sublime.load_settings(sc.get_settings_fn())
-        tab_size = settings.get('format_tab_size')
-        comment_count = 0
-        sreg = []
-        state = ScanState.DEFAULT
-        current_comment = []
-        current_char = -1
-        next_char = -1
-        escaped = False
-
-        # Index is in cleaned version, value is in original.
-        pos_map = []
-
-        # Iterate the string.
-        try:
-            slen = len(s)
-            i = 0
-            while i < slen:
-                current_char = s[i]
-                next_char = s[i + 1] if i < slen - 1 else -1
-
-                # Remove whitespace and transform comments into legal json.
-                if state == ScanState.STRING:
-                    sreg.append(current_char)
-                    pos_map.append(i)
-                    # Handle escaped chars.
-                    if current_char == '\\':
-                        escaped = True
-                    elif current_char == '\"':
-                        if not escaped:
-                            state = ScanState.DEFAULT
-                        escaped = False
-                    else:
-                        escaped = False
-
-                elif state == ScanState.LCOMMENT:
-                    # Handle line comments.
-                    if current_char == '\n':
-                        # End of comment.
-                        scom = ''.join(current_comment)
-                        stag = f'\"//{comment_count}\":\"{scom}\",'
-                        comment_count += 1
-                        sreg.append(stag)
-                        pos_map.append(i)
-                        state = ScanState.DEFAULT
-                        current_comment.clear()
-                    elif current_char == '\r':
-                        # ignore
-                        pass
-                    else:
-                        # Maybe escape.
-                        if current_char == '\"' or current_char == '\\':
-                            current_comment.append('\\')
-                        current_comment.append(current_char)
-
-                elif state == ScanState.BCOMMENT:
-                    # Handle block comments.
-                    if current_char == '*' and next_char == '/':
-                        # End of comment.
-                        scom = ''.join(current_comment)
-                        stag = f'\"//{comment_count}\":\"{scom}\",'
-                        comment_count += 1
-                        sreg.append(stag)
-                        pos_map.append(i)
-                        state = ScanState.DEFAULT
-                        current_comment.clear()
-                        i += 1  # Skip next char.
-                    elif current_char == '\n' or current_char == '\r':
-                        # ignore
-                        pass
-                    else:
-                        # Maybe escape.
-                        if current_char == '\"' or current_char == '\\':
-                            current_comment.append('\\')
-                        current_comment.append(current_char)
-
-                elif state == ScanState.DEFAULT:
-                    # Check for start of a line comment.
-                    if current_char == '/' and next_char == '/':
-                        state = ScanState.LCOMMENT
-                        current_comment.clear()
-                        i += 1  # Skip next char.
-                    # Check for start of a block comment.
-                    elif current_char == '/' and next_char == '*':
-                        state = ScanState.BCOMMENT
-                        current_comment.clear()
-                        i += 1  # Skip next char.
-                    elif current_char == '\"':
-                        sreg.append(current_char)
-                        pos_map.append(i)
-                        state = ScanState.STRING
-                    # Skip ws.
-                    elif current_char not in string.whitespace:
-                        sreg.append(current_char)
-                        pos_map.append(i)
-
-                else:  # state == ScanState.DONE:
-                    pass
-                i += 1  # next
-
-            # Prep for formatting.
-            sout = ''.join(sreg)
-
-            # Remove any trailing commas.
-            sout = re.sub(',}', '}', sout)
-            sout = re.sub(',]', ']', sout)
-
-            # Run it through the formatter.
-            sout = json.loads(sout)
-            sout = json.dumps(sout, indent=int(tab_size))  # pyright: ignore
-
-        except json.JSONDecodeError as je:
-            # Get some context from the original string.
-            context = []
-            original_pos = pos_map[je.pos]
-            start_pos = max(0, original_pos - 40)
-            end_pos = min(len(s) - 1, original_pos + 40)
-            context.append(f'Json Error: {je.msg} pos: {original_pos}')
-            context.append(s[start_pos:original_pos])
-            context.append('---------here----------')
-            context.append(s[original_pos:end_pos])
-            sout = '\n'.join(context)
-            err = True
+        sout, ok = _cached_format(s, 'json', tab_size, syntax, fc.format_json)
 
         vnew = sc.create_new_view(self.view.window(), sout)
-        if not err:
+        if ok:
             vnew.set_syntax_file(SYNTAX_JSON)
+
+
+#-----------------------------------------------------------------------------------
+class SbotFormatFilesCommand(sublime_plugin.WindowCommand):
+    '''
+    Format all json/xml/cx files in paths, and under any dirs in paths, in parallel.
+    Writes in place or to a sibling file and lists the per-file status in a new view.
+    Supports sidebar menu.
+    '''
+
+    def run(self, paths=None, in_place=False):
+        settings = sublime.load_settings(sc.get_settings_fn())
+        tab_size = int(settings.get('format_tab_size'))   # pyright: ignore
+
+        sink = sc.open_output(self.window)
+        sc.start_job('Format', sink.view, self.do_work(paths or [], tab_size, in_place, sink, settings))
+
+    def do_work(self, paths, tab_size, in_place, sink, settings):
+        files = fc.collect_files(paths)
+        executor = _create_executor(settings)
+        # astyle does the work for cx so threads are enough to run several batches at once.
+        astyle_executor = concurrent.futures.ThreadPoolExecutor(os.cpu_count() or 1)
+        counts = {'changed': 0, 'unchanged': 0, 'failed': 0}
+        done_count = 0
+
+        try:
+            # Cx files go to astyle in batches, everything else one by one.
+            pending = set()
+            cx_files = {'c': [], 'cs': []}
+            for fn in files:
+                kind = fc.FILE_KINDS[os.path.splitext(fn)[1].lower()]
+                if kind in cx_files:
+                    cx_files[kind].append(fn)
+                else:
+                    pending.add(executor.submit(fc.format_file, fn, tab_size, in_place))
+
+            for kind, cfiles in cx_files.items():
+                for i in range(0, len(cfiles), fc.ASTYLE_BATCH_SIZE):
+                    batch = cfiles[i:i + fc.ASTYLE_BATCH_SIZE]
+                    pending.add(astyle_executor.submit(fc.format_cx_files, batch, tab_size, kind == 'cs', in_place))
+
+            # Report as they finish without blocking the async thread for long.
+            while len(pending) > 0:
+                done, pending = concurrent.futures.wait(pending, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED)
+                for fut in done:
+                    results = fut.result()
+                    for path, ok, msg in results if isinstance(results, list) else [results]:
+                        # Only list the interesting ones.
+                        if not ok:
+                            sink.write(f'ERR {path}: {msg}\n')
+                            counts['failed'] += 1
+                        elif msg == 'unchanged':
+                            counts['unchanged'] += 1
+                        else:
+                            sink.write(f'OK  {path}: {msg}\n')
+                            counts['changed'] += 1
+                        done_count += 1
+                sink.flush()
+                yield done_count / len(files)
+
+            sink.write(f'===== {counts["changed"]} formatted, {counts["unchanged"]} unchanged, {counts["failed"]} failed =====\n')
+        except GeneratorExit:
+            for fut in pending:
+                fut.cancel()
+            sink.write('===== Cancelled =====\n')
+            raise
+        finally:
+            executor.shutdown(wait=False)
+            astyle_executor.shutdown(wait=False)
+            sink.flush()
+
+    def is_visible(self, paths=None):
+        dir, fn, _ = sc.get_path_parts(self.window, paths)
+        return dir is not None or fn is not None
+
+
+#-----------------------------------------------------------------------------------
+def _get_cache():
+    '''The formatter result cache, in memory and in the plugin store dir.'''
+    global _cache
+    if _cache is None:
+        settings = sublime.load_settings(sc.get_settings_fn())
+        disk_size = int(settings.get('format_cache_size', 100)) * 1024 * 1024   # pyright: ignore
+        _cache = fc.FormatCache(os.path.join(sc.get_store_path(), 'format_cache'), disk_size=disk_size)
+    return _cache
+
+
+#-----------------------------------------------------------------------------------
+def _cached_format(s, name, tab_size, syntax, formatter, *args):
+    '''Run formatter(s, tab_size, *args) unless we already have the answer. Returns (text, ok).'''
+    cache = _get_cache()
+    key = cache.make_key([s], name, tab_size, syntax, *args)
+    sout = cache.get(key)
+    if sout is not None:
+        return (sout, True)
+
+    sout, ok = formatter(s, tab_size, *args)
+    if ok:
+        cache.put(key, sout)
+    return (sout, ok)
+
+
+#-----------------------------------------------------------------------------------
+def _create_executor(settings):
+    '''
+    Process pool if there is a python configured to run the workers - the plugin host can't be used
+    as it isn't a plain python. Otherwise threads, which still keeps astyle runs parallel.
+    '''
+    workers = os.cpu_count() or 1
+    python = settings.get('format_python')
+
+    if python:
+        # Workers import this package by name so they need to be able to find it.
+        if sublime.packages_path() not in sys.path:
+            sys.path.append(sublime.packages_path())
+        ctx = multiprocessing.get_context('spawn')
+        ctx.set_executable(python)
+        return concurrent.futures.ProcessPoolExecutor(workers, mp_context=ctx)
+
+    return concurrent.futures.ThreadPoolExecutor(workers)
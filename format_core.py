@@ -0,0 +1,566 @@
+import os
+import re
+import hashlib
+import threading
+import collections
+import json
+import shutil
+import subprocess
+from xml.parsers import expat
+import bisect
+from array import array
+
+
+# The formatters behind format.py. sbot_format_files runs them in worker processes, which can't import sublime,
+# and tests/bench_format_json.py loads this file on its own.
+
+
+# Json with comments tokens that need special handling. Unterminated strings run to the end,
+# unterminated comments are dropped like the original char scanner did. Everything between is
+# copied with the whitespace removed.
+_RE_JSON_SPECIAL = re.compile(r'''
+    (?P<str>"(?:[^"\\]|\\.)*(?:"|\\?\Z))
+  | (?P<lcom>//[^\n]*(?:\n|\Z))
+  | (?P<bcom>/\*.*?(?:\*/|\Z))
+''', re.VERBOSE | re.DOTALL)
+
+# Same as string.whitespace.
+_WS_DELETE = str.maketrans('', '', ' \t\n\r\x0b\x0c')
+_RE_NOT_WS = re.compile(r'[^ \t\n\r\x0b\x0c]+')
+
+# Comment text to json string content.
+_LCOMMENT_XLAT = str.maketrans({'"': '\\"', '\\': '\\\\', '\r': None})
+_BCOMMENT_XLAT = str.maketrans({'"': '\\"', '\\': '\\\\', '\r': None, '\n': None})
+
+# File types handled by format_file(). Value is kind.
+FILE_KINDS = {'.json': 'json', '.jsonc': 'json', '.xml': 'xml',
+              '.c': 'c', '.h': 'c', '.cpp': 'c', '.hpp': 'c', '.cxx': 'c', '.cc': 'c', '.cs': 'cs'}
+
+# Chars fed to the xml parser at a time.
+XML_CHUNK_SIZE = 64 * 1024
+
+# Files per astyle process when formatting many.
+ASTYLE_BATCH_SIZE = 50
+
+# Appended to the file name root when not formatting in place.
+SIBLING_SUFFIX = '_fmt'
+
+# PosMap run types.
+_RUN_COPY = 0   # chars map one to one
+_RUN_STRIP = 1  # whitespace was removed, resolved by rescanning the original on lookup
+_RUN_SUB = 2    # replaced by something else, maps to the start of the original
+
+
+#-----------------------------------------------------------------------------------
+class PosMap(object):
+    '''
+    Maps positions in cleaned text back to the original. Stored as runs of (out start, in start, in len, type)
+    in arrays rather than one int per char. Lookups are only needed for error reporting so the
+    whitespace stripped runs are worked out then.
+    '''
+
+    def __init__(self, original):
+        self._original = original
+        self._out_starts = array('I')
+        self._in_starts = array('I')
+        self._in_lens = array('I')
+        self._types = array('B')
+
+    def add(self, out_start, in_start, in_len, run_type):
+        '''Map chars at out_start to in_len chars at in_start.'''
+        self._out_starts.append(out_start)
+        self._in_starts.append(in_start)
+        self._in_lens.append(in_len)
+        self._types.append(run_type)
+
+    def lookup(self, out_pos):
+        '''Original position of out_pos.'''
+        if len(self._out_starts) == 0:
+            return 0
+
+        i = max(bisect.bisect_right(self._out_starts, out_pos) - 1, 0)
+        offset = out_pos - self._out_starts[i]
+        in_start = self._in_starts[i]
+        in_len = self._in_lens[i]
+
+        if self._types[i] == _RUN_STRIP:
+            # Count off the non-whitespace.
+            for m in _RE_NOT_WS.finditer(self._original, in_start, in_start + in_len):
+                if offset < m.end() - m.start():
+                    return m.start() + offset
+                offset -= m.end() - m.start()
+            return in_start + max(in_len - 1, 0)
+        elif self._types[i] == _RUN_SUB:
+            return in_start
+        else:
+            return in_start + min(offset, max(in_len - 1, 0))
+
+    def __len__(self):
+        return len(self._out_starts)
+
+
+#-----------------------------------------------------------------------------------
+def clean_json(s):
+    '''
+    Remove whitespace and transform comments into legal json elements like "//0":"comment",
+    Returns (cleaned, pos_map).
+    '''
+    sreg = []
+    pos_map = PosMap(s)
+    out_pos = 0
+    comment_count = 0
+    last = 0
+
+    for m in _RE_JSON_SPECIAL.finditer(s):
+        start, end = m.span()
+
+        # Plain json between.
+        if start > last:
+            sbetween = s[last:start].translate(_WS_DELETE)
+            if len(sbetween) > 0:
+                sreg.append(sbetween)
+                pos_map.add(out_pos, last, start - last, _RUN_STRIP)
+                out_pos += len(sbetween)
+        last = end
+
+        kind = m.lastgroup
+        if kind == 'str':
+            sreg.append(m.group())
+            pos_map.add(out_pos, start, end - start, _RUN_COPY)
+            out_pos += end - start
+            continue
+
+        if kind == 'lcom':
+            if not s.endswith('\n', start, end):
+                continue # unterminated at the end - dropped
+            scom = s[start + 2:end - 1].translate(_LCOMMENT_XLAT)
+        else:
+            if not s.endswith('*/', start + 2, end):
+                continue # unterminated - dropped
+            scom = s[start + 2:end - 2].translate(_BCOMMENT_XLAT)
+
+        stag = f'"//{comment_count}":"{scom}",'
+        comment_count += 1
+        sreg.append(stag)
+        pos_map.add(out_pos, start, end - start, _RUN_SUB)
+        out_pos += len(stag)
+
+    # The rest.
+    sbetween = s[last:].translate(_WS_DELETE)
+    if len(sbetween) > 0:
+        sreg.append(sbetween)
+        pos_map.add(out_pos, last, len(s) - last, _RUN_STRIP)
+
+    return (''.join(sreg), pos_map)
+
+
+#-----------------------------------------------------------------------------------
+def format_json(s, tab_size):
+    '''Format json with comments. Returns (text, ok) where text is the error context if not ok.'''
+    sout, pos_map = clean_json(s)
+
+    # Remove any trailing commas.
+    sout = re.sub(',}', '}', sout)
+    sout = re.sub(',]', ']', sout)
+
+    # Run it through the formatter.
+    try:
+        sout = json.loads(sout)
+        sout = json.dumps(sout, indent=int(tab_size))
+        return (sout, True)
+    except json.JSONDecodeError as je:
+        # Get some context from the original string.
+        context = []
+        original_pos = pos_map.lookup(je.pos)
+        start_pos = max(0, original_pos - 40)
+        end_pos = min(len(s) - 1, original_pos + 40)
+        context.append(f'Json Error: {je.msg} pos: {original_pos}')
+        context.append(s[start_pos:original_pos])
+        context.append('---------here----------')
+        context.append(s[original_pos:end_pos])
+        return ('\n'.join(context), False)
+
+
+#-----------------------------------------------------------------------------------
+class XmlFormatter(object):
+    '''
+    Streaming xml pretty printer. Feed it text in chunks and it writes indented output as it goes,
+    so memory stays flat and nesting depth isn't limited by recursion. Text is stripped. Comments,
+    CDATA and processing instructions are kept. Layout is the same as minidom toprettyxml().
+    '''
+
+    def __init__(self, tab_size, write):
+        self._sindent = ' ' * int(tab_size)
+        self._write = write
+        self._depth = 0
+        self._text = [] # char data collecting
+        self._cdata = False
+        self._pending = None # start tag of the current element until we know if it has children
+        self._pending_child = None # its first child if that was text
+
+        self._parser = expat.ParserCreate()
+        self._parser.ordered_attributes = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text.append
+        self._parser.CommentHandler = self._comment
+        self._parser.ProcessingInstructionHandler = self._pi
+        self._parser.StartCdataSectionHandler = self._start_cdata
+        self._parser.EndCdataSectionHandler = self._end_cdata
+        self._parser.StartDoctypeDeclHandler = self._doctype
+
+        self._write('<?xml version="1.0" ?>\n')
+
+    def feed(self, s):
+        '''Next chunk of input. Raises expat.ExpatError on bad xml.'''
+        self._parser.Parse(s, False)
+
+    def close(self):
+        '''End of input.'''
+        self._parser.Parse('', True)
+
+    def _start(self, name, attrs):
+        self._flush_text()
+        self._open_block()
+        sattrs = ''.join([f' {attrs[i]}="{_escape(attrs[i + 1])}"' for i in range(0, len(attrs), 2)])
+        self._pending = f'{self._sindent * self._depth}<{name}{sattrs}'
+        self._depth += 1
+
+    def _end(self, name):
+        self._flush_text()
+        self._depth -= 1
+        if self._pending is not None:
+            # No children or just one text.
+            if self._pending_child is not None:
+                self._write(f'{self._pending}>{self._pending_child}</{name}>\n')
+            else:
+                self._write(f'{self._pending}/>\n')
+            self._pending = None
+            self._pending_child = None
+        else:
+            self._write(f'{self._sindent * self._depth}</{name}>\n')
+
+    def _comment(self, data):
+        self._flush_text()
+        self._open_block()
+        self._write(f'{self._sindent * self._depth}<!--{data}-->\n')
+
+    def _pi(self, target, data):
+        self._flush_text()
+        self._open_block()
+        self._write(f'{self._sindent * self._depth}<?{target} {data}?>\n')
+
+    def _doctype(self, name, sys_id, pub_id, has_internal_subset):
+        del has_internal_subset
+        sids = ''
+        if pub_id:
+            sids = f' PUBLIC "{pub_id}" "{sys_id}"'
+        elif sys_id:
+            sids = f' SYSTEM "{sys_id}"'
+        self._write(f'<!DOCTYPE {name}{sids}>\n')
+
+    def _start_cdata(self):
+        self._flush_text()
+        self._cdata = True
+
+    def _end_cdata(self):
+        self._cdata = False
+        self._child(f'<![CDATA[{"".join(self._text)}]]>')
+        self._text.clear()
+
+    def _flush_text(self):
+        '''Collected char data is complete.'''
+        if self._cdata:
+            return
+        text = ''.join(self._text).strip()
+        self._text.clear()
+        if len(text) > 0:
+            self._child(_escape(text))
+
+    def _child(self, s):
+        '''Text or CDATA. Goes inline if it turns out to be the only child.'''
+        if self._pending is not None and self._pending_child is None:
+            self._pending_child = s
+        else:
+            self._open_block()
+            self._write(f'{self._sindent * self._depth}{s}\n')
+
+    def _open_block(self):
+        '''The current element has more than one child so write its start tag on its own line.'''
+        if self._pending is not None:
+            self._write(f'{self._pending}>\n')
+            if self._pending_child is not None:
+                self._write(f'{self._sindent * self._depth}{self._pending_child}\n')
+            self._pending = None
+            self._pending_child = None
+
+
+#-----------------------------------------------------------------------------------
+def format_xml(s, tab_size):
+    '''Format xml. Returns (text, ok) where text is the error if not ok.'''
+    buff = []
+    try:
+        formatter = XmlFormatter(tab_size, buff.append)
+        for i in range(0, len(s), XML_CHUNK_SIZE):
+            formatter.feed(s[i:i + XML_CHUNK_SIZE])
+        formatter.close()
+        return (''.join(buff), True)
+    except Exception as e:
+        return (f"Error: {e}", False)
+
+
+#-----------------------------------------------------------------------------------
+def _escape(s):
+    '''Same as minidom.'''
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+
+#-----------------------------------------------------------------------------------
+def format_cx(s, tab_size, cs=False):
+    '''Format C/C++/C# with astyle. Returns (text, ok) where text is the error if not ok.'''
+    try:
+        cp = subprocess.run(_astyle_args(tab_size, cs), input=s, text=True, universal_newlines=True, capture_output=True, check=True)
+        return (cp.stdout, True)
+    except Exception:
+        return ("Format Cx failed. Is astyle installed and in your path?", False)
+
+
+#-----------------------------------------------------------------------------------
+def format_cx_files(paths, tab_size, cs, in_place):
+    '''
+    Format a batch of C/C++/C# files with one astyle process, in place or to sibling files.
+    Returns list of (path, ok, message) like format_file(). Siblings are only left for files that changed
+    and one that's already there is never touched.
+    '''
+    results = {}
+    targets = {} # path -> the file astyle works on
+    for path in paths:
+        if in_place:
+            targets[path] = path
+            continue
+        root, ext = os.path.splitext(path)
+        target = f'{root}{SIBLING_SUFFIX}{ext}'
+        try:
+            _copy_to_sibling(path, target)
+            targets[path] = target
+        except FileExistsError:
+            results[path] = (path, False, f'{target} already exists')
+        except Exception as e:
+            results[path] = (path, False, str(e))
+
+    def fail(msg):
+        for path, target in targets.items():
+            if not in_place:
+                _remove_sibling(target)
+            results[path] = (path, False, msg)
+        return [results[path] for path in paths]
+
+    if len(targets) == 0:
+        return [results[path] for path in paths]
+
+    # No backups, only list the ones changed.
+    try:
+        cp = subprocess.run(_astyle_args(tab_size, cs) + ['-n', '-Q'] + list(targets.values()), text=True, universal_newlines=True, capture_output=True)
+    except Exception:
+        return fail('Is astyle installed and in your path?')
+    if cp.returncode != 0:
+        return fail((cp.stdout + cp.stderr).replace('\n', ' '))
+
+    # Lines like "Formatted  path".
+    changed = set()
+    for line in cp.stdout.splitlines():
+        parts = line.split(None, 1)
+        if len(parts) == 2 and parts[0] == 'Formatted':
+            changed.add(os.path.normcase(os.path.abspath(parts[1].strip())))
+
+    for path, target in targets.items():
+        if os.path.normcase(os.path.abspath(target)) in changed:
+            results[path] = (path, True, target)
+        else:
+            if not in_place:
+                _remove_sibling(target)
+            results[path] = (path, True, 'unchanged')
+    return [results[path] for path in paths]
+
+
+#-----------------------------------------------------------------------------------
+def _astyle_args(tab_size, cs):
+    '''Build the command. Uses --style=allman --indent=spaces=4 --indent-col1-comments --errors-to-stdout'''
+    args = ['astyle', '-A1', f'-s{tab_size}', '-Y', '-X']
+    if cs: # else default of C
+        args.append('--mode=cs')
+    return args
+
+
+#-----------------------------------------------------------------------------------
+def _copy_to_sibling(path, target):
+    '''Copy path to target, which must not exist yet. Raises FileExistsError if it does.'''
+    with open(path, 'rb') as src, open(target, 'xb') as dst:
+        try:
+            shutil.copyfileobj(src, dst)
+        except Exception:
+            dst.close()
+            _remove_sibling(target)
+            raise
+
+
+#-----------------------------------------------------------------------------------
+def _remove_sibling(path):
+    '''Clean up a sibling file that isn't wanted. Best effort.'''
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+#-----------------------------------------------------------------------------------
+def format_file(path, tab_size, in_place):
+    '''
+    Format one file according to its extension, in place or to a sibling file, only writing if it changed.
+    An existing sibling is left alone. Runs in a worker process so everything is plain args. Returns (path, ok, message).
+    '''
+    kind = FILE_KINDS.get(os.path.splitext(path)[1].lower())
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            s = f.read()
+
+        if kind == 'json':
+            sout, ok = format_json(s, tab_size)
+        elif kind == 'xml':
+            sout, ok = format_xml(s, tab_size)
+        elif kind == 'c' or kind == 'cs':
+            sout, ok = format_cx(s, tab_size, kind == 'cs')
+        else:
+            return (path, False, 'unsupported file type')
+
+        if not ok:
+            return (path, False, sout.replace('\n', ' '))
+
+        if in_place:
+            out_path = path
+        else:
+            root, ext = os.path.splitext(path)
+            out_path = f'{root}{SIBLING_SUFFIX}{ext}'
+            if os.path.exists(out_path): # not ours to overwrite
+                return (path, False, f'{out_path} already exists')
+
+        # Same as format_cx_files() - nothing written when there's nothing to change.
+        if sout == s:
+            return (path, True, 'unchanged')
+
+        with open(out_path, 'w' if in_place else 'x', encoding='utf-8') as f:
+            f.write(sout)
+        return (path, True, out_path)
+    except Exception as e:
+        return (path, False, str(e))
+
+
+#-----------------------------------------------------------------------------------
+def collect_files(paths):
+    '''Files in paths, and under any dirs in paths, that format_file() handles.'''
+    files = []
+
+    def want(fn):
+        root, ext = os.path.splitext(fn)
+        return ext.lower() in FILE_KINDS and not root.endswith(SIBLING_SUFFIX)
+
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                files.extend(os.path.join(dirpath, fn) for fn in sorted(filenames) if want(fn))
+        elif os.path.isfile(path) and want(path):
+            files.append(path)
+    return files
+
+
+#-----------------------------------------------------------------------------------
+class FormatCache(object):
+    '''
+    Formatter results keyed by a hash of the input and everything else that affects the output.
+    In-memory LRU in front of a size capped directory of files. Sizes are in chars/bytes, 0 disables that tier.
+    '''
+
+    def __init__(self, dir, mem_size=32 * 1024 * 1024, disk_size=100 * 1024 * 1024):
+        self.dir = dir
+        self.mem_size = mem_size
+        self.disk_size = disk_size
+        self._mem = collections.OrderedDict()
+        self._mem_used = 0
+        self._disk_used = None # lazy
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(chunks, *params):
+        '''Hash of the input, given as an iterable of str, and params.'''
+        h = hashlib.sha256(repr(params).encode('utf-8'))
+        for chunk in chunks:
+            h.update(chunk.encode('utf-8', 'surrogatepass'))
+        return h.hexdigest()
+
+    def get(self, key):
+        '''Cached result or None.'''
+        with self._lock:
+            text = self._mem.get(key)
+            if text is not None:
+                self._mem.move_to_end(key)
+                return text
+
+        fn = os.path.join(self.dir, key)
+        if self.disk_size > 0 and os.path.exists(fn):
+            try:
+                with open(fn, 'r', encoding='utf-8', newline='') as f:
+                    text = f.read()
+                os.utime(fn) # recently used
+                self._put_mem(key, text)
+                return text
+            except Exception:
+                pass
+        return None
+
+    def put(self, key, text):
+        '''Add a result.'''
+        self._put_mem(key, text)
+        if self.disk_size > 0 and len(text) < self.disk_size:
+            self._put_disk(key, text)
+
+    def _put_mem(self, key, text):
+        if len(text) > self.mem_size:
+            return
+        with self._lock:
+            if key in self._mem:
+                return
+            self._mem[key] = text
+            self._mem_used += len(text)
+            while self._mem_used > self.mem_size:
+                _, old = self._mem.popitem(last=False)
+                self._mem_used -= len(old)
+
+    def _put_disk(self, key, text):
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            fn = os.path.join(self.dir, key)
+            tmp_fn = f'{fn}.{threading.get_ident()}.tmp'
+            with open(tmp_fn, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+            os.replace(tmp_fn, fn)
+
+            with self._lock:
+                if self._disk_used is None:
+                    self._disk_used = sum(e.stat().st_size for e in os.scandir(self.dir) if e.is_file())
+                else:
+                    self._disk_used += os.path.getsize(fn)
+                if self._disk_used > self.disk_size:
+                    self._trim_disk()
+        except Exception:
+            pass # it's only a cache
+
+    def _trim_disk(self):
+        '''Remove least recently used files until under size.'''
+        entries = sorted((e for e in os.scandir(self.dir) if e.is_file()), key=lambda e: e.stat().st_mtime)
+        self._disk_used = sum(e.stat().st_size for e in entries)
+        for e in entries:
+            if self._disk_used <= self.disk_size * 0.9:
+                break
+            self._disk_used -= e.stat().st_size
+            os.remove(e.path)
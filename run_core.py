@@ -0,0 +1,155 @@
+import os
+import sys
+import math
+import time
+import queue
+import signal
+import codecs
+import threading
+import subprocess
+import statistics
+import collections
+
+
+# Child process handling for sbot_run - pipe reader threads, exit and resource usage, and the bench stats.
+
+
+# Bytes per pipe read.
+READ_SIZE = 4096
+
+# What a finished process cost. Times in sec, max_rss in bytes. Only wall is available on windows, the rest are None.
+Usage = collections.namedtuple('Usage', 'wall user sys max_rss')
+
+
+#-----------------------------------------------------------------------------------
+class Proc(object):
+    '''
+    A child process with its stdout and stderr read on their own threads so output can be collected
+    as it arrives without blocking. Text is decoded as utf-8 with bad bytes replaced.
+    Another thread waits for it to exit and collects its resource usage.
+    '''
+
+    def __init__(self, cmd, cwd=None, env=None):
+        self.cmd = cmd
+        self.start_time = time.monotonic()
+        self._output = queue.Queue()
+        self._killed = False
+        self._exit_code = None
+        self._usage = None
+
+        # Own process group so kill takes any children with it.
+        kwargs = {}
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
+        else:
+            kwargs['start_new_session'] = True
+
+        self._popen = subprocess.Popen(cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        self._readers = [threading.Thread(target=self._read, args=(self._popen.stdout, 'stdout'), daemon=True),
+                         threading.Thread(target=self._read, args=(self._popen.stderr, 'stderr'), daemon=True)]
+        for t in self._readers:
+            t.start()
+        self._waiter = threading.Thread(target=self._wait, daemon=True)
+        self._waiter.start()
+
+    @property
+    def pid(self):
+        return self._popen.pid
+
+    @property
+    def killed(self):
+        return self._killed
+
+    @property
+    def usage(self):
+        '''Usage once it has exited, otherwise None.'''
+        return self._usage
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def read(self):
+        '''Everything that has arrived since last time as a list of (stream name, text).'''
+        ret = []
+        try:
+            while True:
+                ret.append(self._output.get_nowait())
+        except queue.Empty:
+            pass
+        return ret
+
+    def poll(self, wait_output=True):
+        '''
+        Exit code once the process has exited, and all its output has been read unless wait_output
+        is False, otherwise None. Something it started may hold the pipes open after it has gone.
+        '''
+        if wait_output and any(t.is_alive() for t in self._readers):
+            return None
+        return self._exit_code
+
+    def kill(self):
+        '''Stop it and anything it started.'''
+        if self._exit_code is not None:
+            return
+        self._killed = True
+        try:
+            if sys.platform == 'win32':
+                self._popen.kill()
+            else:
+                os.killpg(self._popen.pid, signal.SIGKILL)
+        except OSError:
+            pass # already gone
+
+    def _wait(self):
+        # Only this reaps the process - Popen doesn't get a look in so it can't take the rusage.
+        if hasattr(os, 'wait4'):
+            _, status, ru = os.wait4(self._popen.pid, 0)
+            wall = time.monotonic() - self.start_time
+            # Linux reports KB, macOS bytes.
+            max_rss = ru.ru_maxrss if sys.platform == 'darwin' else ru.ru_maxrss * 1024
+            self._usage = Usage(wall, ru.ru_utime, ru.ru_stime, max_rss)
+            exit_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            self._popen.returncode = exit_code
+        else:
+            exit_code = self._popen.wait()
+            self._usage = Usage(time.monotonic() - self.start_time, None, None, None)
+        self._exit_code = exit_code
+
+    def _read(self, pipe, name):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        held = '' # a trailing CR that might be half of a CRLF
+        with pipe:
+            while True:
+                data = pipe.read1(READ_SIZE)
+                final = len(data) == 0
+                text = held + decoder.decode(data, final=final)
+                held = ''
+                if text.endswith('\r') and not final:
+                    held = '\r'
+                    text = text[:-1]
+                if len(text) > 0:
+                    self._output.put((name, text.replace('\r\n', '\n')))
+                if final:
+                    break
+
+
+#-----------------------------------------------------------------------------------
+def fmt_usage(usage):
+    '''One line summary of a Usage.'''
+    parts = [f'wall {usage.wall:.3f}s']
+    if usage.user is not None:
+        parts.append(f'user {usage.user:.3f}s')
+        parts.append(f'sys {usage.sys:.3f}s')
+    if usage.max_rss is not None:
+        parts.append(f'peak rss {usage.max_rss / (1024 * 1024):.1f}M')
+    return '  '.join(parts)
+
+
+#-----------------------------------------------------------------------------------
+def summarize(values):
+    '''Stats for a list of numbers as (min, median, p95, stddev). stddev is 0 for one value.'''
+    values = sorted(values)
+    p95 = values[max(math.ceil(len(values) * 0.95) - 1, 0)] # nearest rank
+    stddev = statistics.stdev(values) if len(values) > 1 else 0.0
+    return (values[0], statistics.median(values), p95, stddev)
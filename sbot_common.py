@@ -1,13 +1,16 @@
-from ntpath import exists
 import sys
 import os
 import traceback
 import collections
 import datetime
+import time
 import pathlib
 import shutil
 import subprocess
 import json
+import sqlite3
+import queue
+import threading
 import sublime
 import sublime_plugin
 
@@ -21,6 +24,18 @@ HighlightInfo = collections.namedtuple('HighlightInfo', 'scope_name, region_name
 # Track temporary view.
 _temp_view_id = None
 
+# Times each view has been reopened for output. Key is view id. Sinks from before the latest are stale.
+_sink_gens = {}
+
+# Recent get_path_parts() results. Key is (window id, raw path), value is (time, result).
+_path_cache = {}
+
+# How long a cached path is good for, in seconds.
+_PATH_CACHE_TTL = 2.0
+
+# Open stores. Key is kind.
+_stores = {}
+
 # Plugin data storage dir.
 _store_path = os.path.join(sublime.packages_path(), 'User', _plugin_name)
 pathlib.Path(_store_path).mkdir(parents=True, exist_ok=True)
@@ -33,28 +48,161 @@ pathlib.Path(_store_path).mkdir(parents=True, exist_ok=True)
 
 #-----------------------------------------------------------------------------------
 def read_store():
-    ''' Where to keep the module's stuff.'''
-    fn = os.path.join(_store_path, f'{_plugin_name}.store')
-    if not exists(fn): # assume new, create empty default
-        with open(fn, 'w') as fp:
-            json.dump('{}', fp, indent=4)
-
-    try:
-        with open(fn, 'r') as fp:
-            return json.load(fp)
-    except Exception as e:
-        error(f'Error reading {fn}: {e}', e.__traceback__)
+    ''' Where to keep the module's stuff. Returns a copy of the cached store contents.'''
+    return dict(get_store().data)
 
 
 #-----------------------------------------------------------------------------------
 def write_store(store):
-    ''' Where to keep this module's stuff.'''
-    fn = os.path.join(_store_path, f'{_plugin_name}.store')
-    try:
-        with open(fn, 'w') as fp:
-            json.dump(store, fp, indent=4)
-    except Exception as e:
-        error(f'Error writing {fn}: {e}', e.__traceback__)
+    ''' Where to keep this module's stuff. Written to disk shortly after.'''
+    get_store().replace(store)
+
+
+#-----------------------------------------------------------------------------------
+def get_store(kind='json'):
+    '''The plugin store. kind is json for a small dict, sqlite for larger keyed data.'''
+    if kind not in _stores:
+        if kind == 'sqlite':
+            _stores[kind] = SqliteStore(os.path.join(_store_path, f'{_plugin_name}.sqlite'))
+        else:
+            _stores[kind] = Store(os.path.join(_store_path, f'{_plugin_name}.store'))
+    return _stores[kind]
+
+
+#-----------------------------------------------------------------------------------
+def flush_stores():
+    '''Write anything pending now. Call from plugin_unloaded().'''
+    for store in _stores.values():
+        store.flush()
+
+
+#-----------------------------------------------------------------------------------
+class Store(object):
+    '''
+    Json dict kept in memory. Changes mark it dirty and it is written behind after delay msec,
+    to a temp file then os.replace() so a crash can't leave a half written file.
+    '''
+
+    def __init__(self, fn, delay=1000):
+        self.fn = fn
+        self.delay = delay
+        self.data = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if os.path.exists(fn):
+            try:
+                with open(fn, 'r') as fp:
+                    data = json.load(fp)
+                # Old versions wrote the default as a string.
+                if isinstance(data, dict):
+                    self.data = data
+            except Exception as e:
+                error(f'Error reading {fn}: {e}', e.__traceback__)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self.data[key] = value
+        self.mark_dirty()
+
+    def delete(self, key):
+        with self._lock:
+            self.data.pop(key, None)
+        self.mark_dirty()
+
+    def replace(self, data):
+        '''Replace all contents.'''
+        with self._lock:
+            self.data = dict(data)
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        '''Call after changing data directly.'''
+        with self._lock:
+            if self._dirty:
+                return # already scheduled
+            self._dirty = True
+        sublime.set_timeout_async(self.flush, self.delay)
+
+    def flush(self):
+        '''Write now if dirty.'''
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            sdata = json.dumps(self.data, indent=4)
+
+        tmp_fn = self.fn + '.tmp'
+        try:
+            with open(tmp_fn, 'w') as fp:
+                fp.write(sdata)
+            os.replace(tmp_fn, self.fn)
+        except Exception as e:
+            error(f'Error writing {self.fn}: {e}', e.__traceback__)
+
+
+#-----------------------------------------------------------------------------------
+class SqliteStore(object):
+    '''
+    Same interface as Store for larger keyed data, which isn't all loaded or rewritten.
+    Values are json. Writes go in a transaction that is committed behind after delay msec.
+    '''
+
+    def __init__(self, fn, delay=1000):
+        self.fn = fn
+        self.delay = delay
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(fn, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS store (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM store WHERE key = ?', (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO store (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+        self.mark_dirty()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM store WHERE key = ?', (key,))
+        self.mark_dirty()
+
+    def keys(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT key FROM store')]
+
+    def mark_dirty(self):
+        with self._lock:
+            if self._dirty:
+                return # already scheduled
+            self._dirty = True
+        sublime.set_timeout_async(self.flush, self.delay)
+
+    def flush(self):
+        '''Commit now if dirty.'''
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            try:
+                self._conn.commit()
+            except Exception as e:
+                error(f'Error writing {self.fn}: {e}', e.__traceback__)
+
+
+#-----------------------------------------------------------------------------------
+def get_store_path():
+    ''' Dir for the plugin's data files.'''
+    return _store_path
+
 
 #-----------------------------------------------------------------------------------
 def get_settings_fn():
@@ -85,16 +233,62 @@ def get_sel_regions(view):
     return regions
 
 
+#-----------------------------------------------------------------------------------
+def apply_text_change(spans, a, b, n):
+    '''
+    Update a list of (start, end) for a change that replaced a..b with n chars, and add the changed span.
+    Spans that overlap the change are merged into it.
+    '''
+    delta = n - (b - a)
+    start = a
+    end = a + n
+    ret = []
+    for s, e in spans:
+        if e < a:
+            ret.append((s, e))
+        elif s > b:
+            ret.append((s + delta, e + delta))
+        else:
+            start = min(start, s)
+            end = max(end, e + delta)
+    ret.append((start, end))
+    return ret
+
+
+#-----------------------------------------------------------------------------------
+def merge_regions(regions):
+    '''Sorted regions with overlapping/touching ones combined.'''
+    ret = []
+    for region in sorted(regions, key=lambda r: r.a):
+        if len(ret) > 0 and region.a <= ret[-1].b:
+            ret[-1] = ret[-1].cover(region)
+        else:
+            ret.append(region)
+    return ret
+
+
 #-----------------------------------------------------------------------------------
 def create_new_view(window, text, reuse=True):
     '''Creates or reuse existing temp view with text. Returns the view.'''
+    sink = open_output(window, reuse)
+    sink.write(text)
+    sink.flush()
+    return sink.view
+
+
+#-----------------------------------------------------------------------------------
+def open_output(window, reuse=True, source=None):
+    '''
+    Creates or reuse existing temp view, empty, for streaming into. Returns an OutputSink.
+    source is the view the output is made from - if that's the temp view it's left alone and a new one made.
+    '''
     view = None
     global _temp_view_id
 
     # Locate the current temp view. This will silently fail if there isn't one.
     if reuse:
         for v in window.views():
-            if v.id() == _temp_view_id:
+            if v.id() == _temp_view_id and (source is None or v.id() != source.id()):
                 view = v
                 break
 
@@ -103,15 +297,110 @@ def create_new_view(window, text, reuse=True):
         view = window.new_file()
         view.set_scratch(True)
         _temp_view_id = view.id()
+    else:
+        # Anything still streaming into it is done for. Stale sinks drop whatever they get after this.
+        _sink_gens[view.id()] = _sink_gens.get(view.id(), 0) + 1
+        for job in [j for j in _jobs.values() if j.view.id() == view.id()]:
+            job.stop()
 
-    # Create/populate the view.
-    view.run_command('select_all')
-    view.run_command('cut')
-    view.run_command('append', {'characters': text})  # insert has some odd behavior - indentation
+        # Clear it. Don't use cut as that clobbers the clipboard.
+        view.run_command('select_all')
+        view.run_command('right_delete')
 
     window.focus_view(view)
 
-    return view
+    return OutputSink(view)
+
+
+#-----------------------------------------------------------------------------------
+class OutputSink(object):
+    '''
+    Streams text into the end of a view. Writes are buffered and appended in batches of about batch_size chars
+    so producers can emit as they go without building the whole output in memory or hitting the view per line.
+    '''
+
+    def __init__(self, view, batch_size=64 * 1024):
+        self.view = view
+        self.batch_size = batch_size
+        self.size = 0 # chars written so far, i.e. the view position of the next write
+        self._pending = []
+        self._pending_len = 0
+        self._gen = _sink_gens.get(view.id(), 0)
+
+    @property
+    def stale(self):
+        '''The view has been reopened for other output since this was made so writes go nowhere.'''
+        return _sink_gens.get(self.view.id(), 0) != self._gen
+
+    def write(self, text):
+        '''Add some text.'''
+        if self.stale:
+            return
+        self._pending.append(text)
+        self._pending_len += len(text)
+        self.size += len(text)
+        if self._pending_len >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Push everything written so far into the view.'''
+        if self._pending_len > 0 and not self.stale:
+            # insert has some odd behavior - indentation
+            self.view.run_command('append', {'characters': ''.join(self._pending)})
+        self._pending.clear()
+        self._pending_len = 0
+
+
+#-----------------------------------------------------------------------------------
+class RegionBuilder(object):
+    '''
+    Collects highlight regions in ascending order, merging each with the previous one if they touch
+    or are within gap chars. Stops collecting at max_regions (0 = no limit) and sets truncated
+    so the caller can tell the user rather than flooding add_regions().
+    '''
+
+    def __init__(self, gap=0, max_regions=0):
+        self.gap = gap
+        self.max_regions = max_regions
+        self.truncated = False
+        self._regions = []
+        self._start = -1 # current open run
+        self._end = -1
+
+    def add(self, start, end):
+        '''Add a range. Must not start before the previous one.'''
+        if self._start >= 0 and start <= self._end + self.gap:
+            self._end = max(self._end, end)
+        else:
+            self._close_run()
+            self._start = start
+            self._end = end
+
+    def add_spans(self, spans, offset=0):
+        '''Add a sequence of (start, end) tuples, shifted by offset.'''
+        for start, end in spans:
+            self.add(start + offset, end + offset)
+
+    def regions(self, final=True):
+        '''
+        Get the list of sublime.Region. final closes the current run, otherwise it's included
+        as it stands and more adds can still extend it.
+        '''
+        if final:
+            self._close_run()
+            return self._regions
+        if self._start >= 0 and (self.max_regions <= 0 or len(self._regions) < self.max_regions):
+            return self._regions + [sublime.Region(self._start, self._end)]
+        return list(self._regions)
+
+    def _close_run(self):
+        if self._start >= 0:
+            if self.max_regions > 0 and len(self._regions) >= self.max_regions:
+                self.truncated = True
+            else:
+                self._regions.append(sublime.Region(self._start, self._end))
+        self._start = -1
+        self._end = -1
 
 
 #-----------------------------------------------------------------------------------
@@ -200,6 +489,13 @@ def get_path_parts(window, paths):
     else:  # maybe image preview - dig out file name
         path = window.extract_variables().get('file')
 
+    # Menus call this for every entry so reuse a recent answer rather than hitting the file system again.
+    key = (window.id(), path)
+    now = time.monotonic()
+    cached = _path_cache.get(key)
+    if cached is not None and now - cached[0] < _PATH_CACHE_TTL:
+        return cached[1]
+
     if path is not None:
         exp_path = expand_vars(path)
         if exp_path is not None:
@@ -212,9 +508,21 @@ def get_path_parts(window, paths):
                 fn = None
         path = exp_path
 
+    # Drop stale entries now and then.
+    if len(_path_cache) > 100:
+        for k in [k for k, v in _path_cache.items() if now - v[0] >= _PATH_CACHE_TTL]:
+            del _path_cache[k]
+    _path_cache[key] = (now, (dir, fn, path))
+
     return (dir, fn, path)
 
 
+#-----------------------------------------------------------------------------------
+def clear_path_cache():
+    '''Forget cached get_path_parts() results. Call when files may have changed.'''
+    _path_cache.clear()
+
+
 #-----------------------------------------------------------------------------------
 def open_path(path):
     '''Acts as if you had clicked the path in the UI. Honors your file associations.'''
@@ -247,6 +555,106 @@ def open_terminal(where):
     # Unity -> gnome-terminal --profile=Default
 
 
+#-----------------------------------------------------------------------------------
+#---------------------------- Background jobs --------------------------------------
+#-----------------------------------------------------------------------------------
+
+# Running jobs. Key is job name.
+_jobs = {}
+
+
+#-----------------------------------------------------------------------------------
+class Job(object):
+    '''
+    Runs work on the async thread a chunk at a time so the UI stays responsive. work is a generator
+    that does one chunk per iteration and yields progress 0.0 to 1.0, which is shown in the status bar of view,
+    or None if it can't tell. interval is msec between chunks, for work that is waiting on something.
+    Cancelling closes the generator so it can clean up in finally/GeneratorExit, on its next step,
+    or right away with stop().
+    '''
+
+    def __init__(self, name, view, work, interval=0):
+        self.name = name
+        self.view = view
+        self.interval = interval
+        self.cancelled = False
+        self.finished = False
+        self._work = work
+        self._last_pct = -1
+
+    def cancel(self):
+        self.cancelled = True
+
+    def stop(self):
+        '''Cancel and clean up now rather than on the next step.'''
+        self.cancel()
+        if _jobs.get(self.name) is self:
+            del _jobs[self.name]
+        try:
+            self._finish()
+        except ValueError:
+            pass # mid step on the async thread, it will finish when that's done
+
+    def _step(self):
+        if self.finished:
+            return
+        if self.cancelled:
+            self._finish()
+            return
+
+        try:
+            progress = next(self._work)
+        except StopIteration:
+            self._finish()
+            return
+        except Exception as e:
+            self._finish()
+            error(f'{self.name} failed: {e}', e.__traceback__)
+            return
+
+        pct = None if progress is None else int(progress * 100)
+        if pct != self._last_pct:
+            self.view.set_status('job', f'{self.name} ...' if pct is None else f'{self.name} {pct}%')
+            self._last_pct = pct
+
+        # Go around again, letting anything else queued on the async thread have a turn.
+        sublime.set_timeout_async(self._step, self.interval)
+
+    def _finish(self):
+        if self.finished:
+            return
+        self._work.close()
+        self.finished = True
+        self.view.erase_status('job')
+        if _jobs.get(self.name) is self:
+            del _jobs[self.name]
+
+
+#-----------------------------------------------------------------------------------
+def start_job(name, view, work, interval=0):
+    '''Start work (see Job) in the background. A running job with the same name is cancelled first. Returns the Job.'''
+    cancel_job(name)
+    job = Job(name, view, work, interval)
+    _jobs[name] = job
+    sublime.set_timeout_async(job._step, 0)
+    return job
+
+
+#-----------------------------------------------------------------------------------
+def cancel_job(name):
+    '''Stop a running job. Returns True if there was one.'''
+    job = _jobs.pop(name, None)
+    if job is not None:
+        job.cancel()
+    return job is not None
+
+
+#-----------------------------------------------------------------------------------
+def is_job_running(name):
+    '''Check for a running job.'''
+    return name in _jobs
+
+
 #-----------------------------------------------------------------------------------
 #---------------------------- Logging functions ------------------------------------
 #-----------------------------------------------------------------------------------
@@ -254,15 +662,27 @@ def open_terminal(where):
 # Local log file.
 _log_fn = os.path.join(_store_path, f'{_plugin_name}.log')
 
+# Log levels in order of importance. Value is rank.
+_log_levels = {'DBG': 0, 'INF': 1, 'WRN': 2, 'ERR': 3}
 
-#-----------------------------------------------------------------------------------
-# Initialize logging. Maybe roll over log now.
-if os.path.exists(_log_fn) and os.path.getsize(_log_fn) > 50000:
-    bup = _log_fn.replace('.log', '_old.log')
-    shutil.copyfile(_log_fn, bup)
-    # Clear current log file.
-    with open(_log_fn, 'w'):
-        pass
+# Records below this rank are dropped.
+_log_min_rank = 0
+
+# Records waiting for the writer thread. None tells it to stop.
+_log_queue = queue.Queue()
+_log_thread = None
+_log_thread_lock = threading.Lock() # logging comes from the UI and async threads
+
+# Writer batches records for up to this long (sec) or this many records.
+_LOG_FLUSH_INTERVAL = 0.5
+_LOG_FLUSH_SIZE = 200
+
+# Roll over when the log gets this big, keeping this many old ones.
+_log_max_size = 50000
+_log_generations = 3
+
+# Recent records in memory, for viewing without going to the file.
+_log_recent = collections.deque(maxlen=500)
 
 
 #-----------------------------------------------------------------------------------
@@ -299,12 +719,48 @@ def debug(message):
     _write_log('DBG', message)
 
 
+#-----------------------------------------------------------------------------------
+def configure_log(level='DBG', max_size=50000, generations=3):
+    '''Set the minimum level written (DBG, INF, WRN, ERR), size to roll over at and number of old logs kept.'''
+    global _log_min_rank, _log_max_size, _log_generations
+    _log_min_rank = _log_levels.get(level, 0)
+    _log_max_size = max_size
+    _log_generations = max(generations, 1)
+
+
+#-----------------------------------------------------------------------------------
+def get_recent_log(level='DBG'):
+    '''Recent log lines at or above level, oldest first. From memory, doesn't touch the file.'''
+    min_rank = _log_levels.get(level, 0)
+    return [f'{time_str} {lvl} {fn}:{line} {message}' for time_str, lvl, fn, line, message, _ in list(_log_recent)
+            if _log_levels[lvl] >= min_rank]
+
+
+#-----------------------------------------------------------------------------------
+def stop_log():
+    '''Write anything pending and stop the writer thread. Call from plugin_unloaded().'''
+    global _log_thread
+    with _log_thread_lock:
+        thread = _log_thread
+    if thread is None:
+        return
+
+    _log_queue.put(None)
+    thread.join(2.0)
+    # If it's still going it's done once it gets to the None. The next record starts another after that.
+    with _log_thread_lock:
+        if _log_thread is thread and not thread.is_alive():
+            _log_thread = None
+
+
 #-----------------------------------------------------------------------------------
 def _write_log(level, message, tb=None):
-    '''Format a standard message with caller info and log it.'''
+    '''Format a standard message with caller info and queue it for the writer.'''
+    global _log_thread
 
-    # if _log_fn == INVALID_FN:
-    #     raise RuntimeError('Logger has not been initialized.')
+    # Filtered out? Get out before doing any work.
+    if _log_levels[level] < _log_min_rank:
+        return
 
     # Sometimes get stray empty lines.
     if len(message) == 0:
@@ -322,17 +778,74 @@ def _write_log(level, message, tb=None):
 
     time_str = f'{str(datetime.datetime.now())}'[0:-3]
 
-    # Write the record. No need to be synchronized across multiple sbot plugins
-    # as ST docs say that API runs on a single thread.
-    with open(_log_fn, 'a') as log:
-        out_line = f'{time_str} {level} {fn}:{line} {message}'
-        log.write(out_line + '\n')
-        if tb is not None:
-            # The traceback formatter is a bit ugly - clean it up.
-            tblines = []
-            for s in traceback.format_tb(tb):
-                if len(s) > 0:
-                    tblines.append(s[:-1])
-            stb = '\n'.join(tblines)
-            log.write(stb + '\n')
-        log.flush()
+    # Only ever one writer, and a new one only once the last has stopped.
+    with _log_thread_lock:
+        if _log_thread is None or not _log_thread.is_alive():
+            _log_thread = threading.Thread(target=_log_writer, name=f'{_plugin_name}_log', daemon=True)
+            _log_thread.start()
+
+    # Format the traceback now - holding on to it would keep all its frames and their locals alive.
+    tb_text = None
+    if tb is not None:
+        # The traceback formatter is a bit ugly - clean it up.
+        tb_text = '\n'.join(s[:-1] for s in traceback.format_tb(tb) if len(s) > 0)
+
+    rec = (time_str, level, fn, line, message, tb_text)
+    _log_recent.append(rec)
+    _log_queue.put(rec)
+
+
+#-----------------------------------------------------------------------------------
+def _log_writer():
+    '''Writer thread. Takes records off the queue and writes them in batches.'''
+    while True:
+        # Wait for something then collect more for a while.
+        batch = [_log_queue.get()]
+        deadline = time.monotonic() + _LOG_FLUSH_INTERVAL
+        while batch[-1] is not None and len(batch) < _LOG_FLUSH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_log_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        stop = batch[-1] is None
+        lines = []
+        for rec in batch:
+            if rec is None:
+                continue
+            time_str, level, fn, line, message, tb_text = rec
+            lines.append(f'{time_str} {level} {fn}:{line} {message}\n')
+            if tb_text is not None:
+                lines.append(tb_text + '\n')
+
+        if len(lines) > 0:
+            try:
+                with open(_log_fn, 'a') as log:
+                    log.write(''.join(lines))
+                if os.path.getsize(_log_fn) > _log_max_size:
+                    _rotate_log()
+            except Exception as e:
+                print(f'{_plugin_name} log write failed: {e}')
+
+        if stop:
+            return
+
+
+#-----------------------------------------------------------------------------------
+def _rotate_log():
+    '''Roll over by renaming: x.log -> x_1.log -> x_2.log ... dropping the oldest.'''
+    root, ext = os.path.splitext(_log_fn)
+    for i in range(_log_generations - 1, 0, -1):
+        older = f'{root}_{i}{ext}'
+        if os.path.exists(older):
+            os.replace(older, f'{root}_{i + 1}{ext}')
+    os.replace(_log_fn, f'{root}_1{ext}')
+
+
+#-----------------------------------------------------------------------------------
+# Initialize logging. Maybe roll over log now.
+if os.path.exists(_log_fn) and os.path.getsize(_log_fn) > _log_max_size:
+    _rotate_log()
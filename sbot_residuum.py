@@ -5,35 +5,161 @@ import shutil
 import string
 import re
 import enum
+import itertools
 import sublime
 import sublime_plugin
 from . import sbot_common as sc
+from . import tree_core as tc
+from . import run_core as rc
+
+
+# Lines written per step of the tree job.
+TREE_BATCH_SIZE = 1000
+
+# Dir listings for sbot_tree, kept for the session.
+_tree_cache = tc.DirCache()
+
+# Markdown style link [tag](path). One line only.
+_RE_LINK = re.compile(r'\[([^\]\n]*)\]\(([^\)\n]*)\)')
+
+# Hidden regions of the links in a view and the parts changed since they were found.
+LINKS_KEY = 'sbot_links'
+LINKS_DIRTY_KEY = 'sbot_links_dirty'
+
+# Views with a link index.
+_link_views = set()
+
+# Last find_path() per view id as ((change_count, point), path).
+_link_memo = {}
+
+# Project file indexes and the folders each was asked for. Key is window id.
+_file_indexes = {}
+_index_roots = {}
+
+# Window commands that add/remove/move files behind our back. The dirs they touch are read again after them.
+_FILE_COMMANDS = {'rename_path', 'rename_file', 'delete_file', 'delete_folder', 'new_folder', 'sbot_copy_file', 'sbot_delete_file'}
+
+# Paths the running file command is about to touch. Key is window id.
+_touched = {}
+
+# Dirs a file command touched as dir -> mtime when last read, None if not read yet. The ones that prompt
+# for a name change things after they return so each is read again the next time it changes. Key is window id.
+_pending_dirs = {}
+
+# Running sbot_run processes. Key is output view id, value is job name.
+_runs = {}
+_run_count = 0
 
 
 #-----------------------------------------------------------------------------------
 def plugin_loaded():
     '''Called per plugin instance.'''
-    pass
+    settings = sublime.load_settings(sc.get_settings_fn())
+    sc.configure_log(str(settings.get('log_level', 'INF')), int(settings.get('log_max_size', 50000)), int(settings.get('log_generations', 3)))   # pyright: ignore
 
 
 #-----------------------------------------------------------------------------------
 def plugin_unloaded():
     '''Ditto.'''
-    pass
+    sc.flush_stores()
+    sc.stop_log()
 
 
 #-----------------------------------------------------------------------------------
 class SbotEvent(sublime_plugin.EventListener):
     ''' Listener for window events of global interest. '''
 
+    # Per view position status. Key is view id.
+    _pos_tokens = {} # latest update request
+    _pos_status = {} # last shown
+
     def on_init(self, views):
         ''' First thing that happens when plugin/window created. Initialize everything. '''
         del views
 
-    def on_selection_modified(self, view):
-        ''' Show the abs position in the status bar. '''
-        caret = sc.get_single_caret(view)
-        view.set_status("position", '???' if caret is None else f'Pos {caret}')
+    def on_activated(self, view):
+        ''' Paths may have changed while we were elsewhere. '''
+        sc.clear_path_cache()
+        window = view.window()
+        if window is not None:
+            _refresh_file_index(window)
+            if len(_pending_dirs.get(window.id(), {})) > 0:
+                sublime.set_timeout_async(lambda: _update_file_index(window))
+
+    def on_post_save(self, view):
+        ''' Maybe a new file. '''
+        sc.clear_path_cache()
+        window = view.window()
+        index = _file_indexes.get(window.id()) if window is not None else None
+        if index is not None and view.file_name() is not None:
+            index.add(view.file_name())
+
+    def on_window_command(self, window, command_name, args):
+        ''' Note what a file command is going to touch - its view may be gone after. '''
+        if command_name in _FILE_COMMANDS:
+            _touched[window.id()] = _command_paths(window, args)
+
+    def on_post_window_command(self, window, command_name, args):
+        ''' Files moved around. Only the dirs they were in get read again. '''
+        del args
+        if command_name in _FILE_COMMANDS:
+            sc.clear_path_cache()
+            paths = _touched.pop(window.id(), [])
+            sublime.set_timeout_async(lambda: _update_file_index(window, paths))
+
+    def on_pre_close_window(self, window):
+        ''' Done with its index. '''
+        sc.cancel_job(f'Index {window.id()}')
+        _file_indexes.pop(window.id(), None)
+        _index_roots.pop(window.id(), None)
+        _touched.pop(window.id(), None)
+        _pending_dirs.pop(window.id(), None)
+
+    def on_close(self, view):
+        ''' View file is gone. '''
+        if view.id() in _runs:
+            sc.cancel_job(_runs[view.id()])
+        _link_views.discard(view.id())
+        _link_memo.pop(view.id(), None)
+        self._pos_tokens.pop(view.id(), None)
+        self._pos_status.pop(view.id(), None)
+        sc.clear_path_cache()
+
+    def on_selection_modified_async(self, view):
+        ''' Show the abs position in the status bar. Bursts of caret moves are coalesced into one update. '''
+        vid = view.id()
+        token = self._pos_tokens.get(vid, 0) + 1
+        self._pos_tokens[vid] = token
+        settings = sublime.load_settings(sc.get_settings_fn())
+        delay = int(settings.get('position_debounce', 100))   # pyright: ignore
+        sublime.set_timeout_async(lambda: self._update_position(view, token), delay)
+
+    def _update_position(self, view, token):
+        ''' Do it if this is still the latest request for the view. '''
+        vid = view.id()
+        if self._pos_tokens.get(vid) != token or not view.is_valid():
+            return
+
+        sels = view.sel()
+        if len(sels) == 0:
+            status = '???'
+        elif len(sels) == 1:
+            status = f'Pos {sels[0].b}'
+        else:  # Cheap summary for multiple.
+            status = f'Sel {len(sels)} Chars {sum(len(r) for r in sels)}'
+
+        if self._pos_status.get(vid) != status:
+            view.set_status("position", status)
+            self._pos_status[vid] = status
+
+
+#-----------------------------------------------------------------------------------
+class SbotShowLogCommand(sublime_plugin.WindowCommand):
+    ''' Show recent log records from memory. sbot_show_log level=DBG|INF|WRN|ERR '''
+
+    def run(self, level='DBG'):
+        lines = sc.get_recent_log(level)
+        sc.create_new_view(self.window, '\n'.join(lines) + '\n' if len(lines) > 0 else f'No {level} or above log records\n')
 
 
 #-----------------------------------------------------------------------------------
@@ -79,21 +205,27 @@ class SbotOpenContextPathCommand(sublime_plugin.TextCommand):
         return syn is not None and syn.name != 'Notr' and path is not None
 
     def find_path(self, event):
+        # Menus ask is_visible, description and run in turn for the same spot so remember the last answer.
+        pt = self.view.window_to_text((event["x"], event["y"]))
+        key = (self.view.change_count(), pt)
+        memo = _link_memo.get(self.view.id())
+        if memo is not None and memo[0] == key:
+            return memo[1]
+
         ret = None
 
         # Get the text.
-        pt = self.view.window_to_text((event["x"], event["y"]))
         line = self.view.line(pt) # Region
         text = self.view.substr(line)
 
         # Test all matches on the line against the one where the cursor is.
-        rex = re.compile(r'\[(.*)\]\(([^\)]*)\)')
-        it = rex.finditer(text)
-        for match in it:
+        for match in _RE_LINK.finditer(text):
             if match.start() <= (pt - line.a) and match.end() >= (pt - line.a):
-                path = match.group(2)
-                if os.path.exists(path):
+                path = _resolve_path(self.view, match.group(2))
+                if path is not None:
                     ret = path
+
+        _link_memo[self.view.id()] = (key, ret)
         return ret
 
     def description(self, event):
@@ -105,34 +237,102 @@ class SbotOpenContextPathCommand(sublime_plugin.TextCommand):
         return True
 
 
+#-----------------------------------------------------------------------------------
+class SbotJumpToLinkCommand(sublime_plugin.TextCommand):
+    ''' Pick one of the [tag](path) links in the view and go there. '''
+
+    def run(self, edit):
+        del edit
+        view = self.view
+        links = _update_link_index(view.buffer().primary_view())
+        if len(links) == 0:
+            sc.info('No links')
+            return
+
+        items = []
+        for region in links:
+            match = _RE_LINK.fullmatch(view.substr(region))
+            tag, path = match.groups() if match is not None else ('?', '?')
+            row, _ = view.rowcol(region.a)
+            items.append(sublime.QuickPanelItem(tag if len(tag) > 0 else path, annotation=f'{row + 1}: {path}'))
+
+        # Start at the first one after the caret.
+        caret = sc.get_single_caret(view)
+        selected = next((i for i, r in enumerate(links) if caret is not None and r.a >= caret), 0)
+        orig_sel = list(view.sel())
+
+        def show(i):
+            view.sel().clear()
+            view.sel().add(links[i])
+            view.show_at_center(links[i])
+
+        def done(i):
+            if i >= 0:
+                show(i)
+            else: # put it back
+                view.sel().clear()
+                view.sel().add_all(orig_sel)
+                view.show(orig_sel[0] if len(orig_sel) > 0 else 0)
+
+        view.window().show_quick_panel(items, done, selected_index=selected, on_highlight=show)
+
+
+#-----------------------------------------------------------------------------------
+class SbotLinkListener(sublime_plugin.TextChangeListener):
+    ''' Marks where indexed views changed so only those lines get scanned again. '''
+
+    def on_text_changed(self, changes):
+        view = self.buffer.primary_view()
+        if view is None or view.id() not in _link_views:
+            return
+
+        # See SbotTouchedListener.
+        spans = []
+        for change in changes:
+            spans = sc.apply_text_change(spans, change.a.pt, change.b.pt, len(change.str))
+
+        regions = view.get_regions(LINKS_DIRTY_KEY)
+        regions.extend(sublime.Region(start, end) for start, end in spans)
+        view.add_regions(LINKS_DIRTY_KEY, regions, flags=sublime.HIDDEN)
+
+
 #-----------------------------------------------------------------------------------
 class SbotTreeCommand(sublime_plugin.WindowCommand):
-    ''' Run tree command to a new view. '''
+    '''
+    Directory tree to a new view. Walks in the background and streams the lines as it goes.
+    Listings are cached by dir mtime so running it again on a big tree only rereads what changed.
+    '''
 
-    def run(self, paths=None):
+    def run(self, paths=None, depth=None, sizes=None):
         dir, _, _ = sc.get_path_parts(self.window, paths)
+        settings = sublime.load_settings(sc.get_settings_fn())
+
+        # Args override settings.
+        depth = int(settings.get('tree_depth', 0) if depth is None else depth)   # pyright: ignore
+        sizes = bool(settings.get('tree_sizes', False) if sizes is None else sizes)
+        ignore = settings.get('tree_ignore', [])
+        gitignore = bool(settings.get('tree_gitignore', True))
+        chars = tc.TREE_UNICODE if settings.get('tree_unicode') else tc.TREE_ASCII
 
+        sink = sc.open_output(self.window)
+        lines = tc.walk_tree(dir, _tree_cache, depth, ignore, gitignore, sizes, chars)
+        sc.start_job('Tree', sink.view, self.do_work(lines, sink))
+
+    def do_work(self, lines, sink):
         try:
-            # Try treex first. treex [-c] [-f] [-d N] [-s] [-?] [-e fld 1,fld2,...] [-i fld1,fld2,...] [dir]")
-            #   dir: start folder or current if missing
-            #   -c: color output (default is off=monochrome)
-            #   -u: unicode output otherwise ascii (default is ascii)
-            #   -d num: maxDepth (default is 0 which means all)
-            #   -f: show files (default is just dirs)
-            #   -s: show file size (default is false)
-
-            cmd = f'treex "{dir}"' if shutil.which("treex") else f'tree "{dir}" /a /f'
-            cp = subprocess.run(cmd, universal_newlines=True, capture_output=True, shell=True, check=True)
-
-            # Note that unicode is not handled as you would expect on windows:
-            # https://github.com/python/cpython/issues/105312
-            # TODO Workaround for now for Notr - exec processes handle unicode improperly.: 
-            settings = sublime.load_settings(sc.get_settings_fn())
-            tree_unicode = settings.get('tree_unicode')
-            sout = cp.stdout.replace('+---', '├── ').replace(R'\---', '└── ').replace('|   ', '│   ') if tree_unicode else cp.stdout
-            sc.create_new_view(self.window, sout)
-        except Exception as e:
-            sc.create_new_view(self.window, f'Well, that did not go well: {e} {e.__traceback__}')
+            count = 0
+            for line, progress in lines:
+                sink.write(line + '\n')
+                count += 1
+                if count % TREE_BATCH_SIZE == 0:
+                    sink.flush()
+                    yield progress
+        except GeneratorExit:
+            sink.write('===== Cancelled =====\n')
+            raise
+        finally:
+            lines.close()
+            sink.flush()
 
     def is_visible(self, paths=None):
         dir, _, _ = sc.get_path_parts(self.window, paths)
@@ -142,7 +342,8 @@ class SbotTreeCommand(sublime_plugin.WindowCommand):
 #-----------------------------------------------------------------------------------
 class SbotRunCommand(sublime_plugin.WindowCommand):
     '''
-    If the clicked file is a script, it is executed and the output presented in a new view.
+    If the clicked file is a script, it is executed and the output streamed to a new view as it arrives,
+    followed by the exit code, times and peak memory.
     Otherwise acts as if you had double-clicked the file in the UI, honors your file associations.
     Supports context and sidebar menus.
     Doesn't support entering user args currently.
@@ -152,31 +353,26 @@ class SbotRunCommand(sublime_plugin.WindowCommand):
         dir, fn, path = sc.get_path_parts(self.window, paths)
 
         if fn is not None: # Plain file
-            _, ext = os.path.splitext(fn)
+            cmd = _script_cmd(fn, path)
+            if cmd is None:
+                # Simple file click.
+                sc.open_path(path)
+                return
+
+            settings = sublime.load_settings(sc.get_settings_fn())
+            if not _can_run(settings):
+                return
+
             try:
-                cmd_list = []
-                if ext == '.py':
-                    cmd_list.append('python')
-                    cmd_list.append(f'\"{path}\"')
-                elif ext == '.lua':
-                    cmd_list.append('lua')
-                    cmd_list.append(f'\"{path}\"')
-                elif ext in ['.cmd', '.bat', '.sh']:
-                    cmd_list.append(f'\"{path}\"')
-                else:
-                    # Simple file click.
-                    sc.open_path(path)
-                    return
-
-                cmd = ' '.join(cmd_list)
-                cp = subprocess.run(cmd, cwd=dir, universal_newlines=True, capture_output=True, shell=True)
-                output = cp.stdout
-                errors = cp.stderr
-                if len(errors) > 0:
-                    output = output + '============ stderr =============\n' + errors
-                sc.create_new_view(self.window, output)
+                proc = _start_proc(cmd, dir)
             except Exception as e:
                 sc.error(f"Run failed: {e}", e.__traceback__)
+                return
+
+            view, name = _new_run_view(self.window, fn)
+            timeout = float(settings.get('run_timeout', 0))   # pyright: ignore
+            interval = int(settings.get('run_interval', 100))   # pyright: ignore
+            sc.start_job(name, view, self.do_work(proc, view.id(), timeout, sc.OutputSink(view)), interval)
         elif dir is not None: # Plain directory
             pass # or??
         elif path.startswith('http'): # Special case.
@@ -184,6 +380,18 @@ class SbotRunCommand(sublime_plugin.WindowCommand):
         else:
             sc.error(f"Invalid path: {path}")
 
+    def do_work(self, proc, vid, timeout, sink):
+        try:
+            exit_code = yield from _pump(proc, timeout, sink)
+            sink.write(f'\n===== Exit code {exit_code}  {rc.fmt_usage(proc.usage)} =====\n')
+        except GeneratorExit:
+            proc.kill()
+            sink.write('\n===== Killed =====\n')
+            raise
+        finally:
+            _runs.pop(vid, None)
+            sink.flush()
+
     def is_visible(self, paths=None):
         dir, fn, path = sc.get_path_parts(self.window, paths)
         if fn is not None or (path is not None and path.startswith('http')): # Special case.
@@ -191,6 +399,85 @@ class SbotRunCommand(sublime_plugin.WindowCommand):
         return False
 
 
+#-----------------------------------------------------------------------------------
+class SbotRunBenchCommand(sublime_plugin.WindowCommand):
+    '''
+    Run a script count times, one after the other, and list how long each took and how much memory it
+    used, then min/median/p95/stddev. Script output is not shown. Supports context and sidebar menus.
+    '''
+
+    def run(self, paths=None, count=None):
+        dir, fn, path = sc.get_path_parts(self.window, paths)
+        cmd = _script_cmd(fn, path) if fn is not None else None
+        settings = sublime.load_settings(sc.get_settings_fn())
+        if cmd is None or not _can_run(settings):
+            return
+
+        count = int(settings.get('run_bench_count', 10) if count is None else count)   # pyright: ignore
+        view, name = _new_run_view(self.window, f'{fn} x{count}')
+        timeout = float(settings.get('run_timeout', 0))   # pyright: ignore
+        interval = int(settings.get('run_interval', 100))   # pyright: ignore
+        sc.start_job(name, view, self.do_work(cmd, dir, count, view.id(), timeout, sc.OutputSink(view)), interval)
+
+    def do_work(self, cmd, dir, count, vid, timeout, sink):
+        proc = None
+        usages = []
+        try:
+            sink.write(f'===== {" ".join(cmd)} x{count} =====\n')
+            for i in range(count):
+                proc = _start_proc(cmd, dir)
+                exit_code = yield from _pump(proc, timeout, None)
+                usages.append(proc.usage)
+                sink.write(f'{i + 1:>4}  exit {exit_code}  {rc.fmt_usage(proc.usage)}\n')
+                sink.flush()
+                if exit_code != 0:
+                    sink.write('===== Stopped on failure =====\n')
+                    break
+                yield (i + 1) / count
+
+            # Stats for whatever we got.
+            if len(usages) > 0:
+                sink.write(f'\n{"":<12}{"min":>10}{"median":>10}{"p95":>10}{"stddev":>10}\n')
+                rows = [('wall s', [u.wall for u in usages], 1),
+                        ('user s', [u.user for u in usages], 1),
+                        ('sys s', [u.sys for u in usages], 1),
+                        ('peak rss M', [u.max_rss for u in usages], 1024 * 1024)]
+                for label, values, scale in rows:
+                    if values[0] is not None:
+                        stats = ''.join([f'{v / scale:>10.3f}' for v in rc.summarize(values)])
+                        sink.write(f'{label:<12}{stats}\n')
+        except GeneratorExit:
+            if proc is not None:
+                proc.kill()
+            sink.write('\n===== Killed =====\n')
+            raise
+        except Exception as e:
+            sink.write(f'===== Run failed: {e} =====\n')
+        finally:
+            _runs.pop(vid, None)
+            sink.flush()
+
+    def is_visible(self, paths=None):
+        _, fn, path = sc.get_path_parts(self.window, paths)
+        return fn is not None and _script_cmd(fn, path) is not None
+
+
+#-----------------------------------------------------------------------------------
+class SbotRunKillCommand(sublime_plugin.WindowCommand):
+    '''Kill the sbot_run in the current view, or the latest one if this isn't one of them.'''
+
+    def run(self):
+        view = self.window.active_view()
+        name = _runs.get(view.id()) if view is not None else None
+        if name is None and len(_runs) > 0:
+            name = list(_runs.values())[-1]
+        if name is not None:
+            sc.cancel_job(name)
+
+    def is_enabled(self):
+        return len(_runs) > 0
+
+
 #-----------------------------------------------------------------------------------
 class SbotTerminalCommand(sublime_plugin.WindowCommand):
     '''
@@ -209,20 +496,235 @@ class SbotTerminalCommand(sublime_plugin.WindowCommand):
 
 #-----------------------------------------------------------------------------------
 class SbotInsertLineIndexesCommand(sublime_plugin.TextCommand):
-    ''' Insert sequential numbers in first column. Default is to start at 1. '''
+    '''
+    Insert sequential numbers in first column. Default is to start at 1.
+    Each region is built in memory and replaced in one go rather than an insert per line.
+    '''
 
-    def run(self, edit):
-        # Iterate lines.
-        line_count = self.view.rowcol(self.view.size())[0]
-        width = len(str(line_count))
-        offset = 0
-
-        for region in sc.get_sel_regions(self.view):
-            line_num = 1
-            offset = 0
-            for line_region in self.view.split_by_newlines(region):
-                s = f'{line_num:0{width}} '
-                self.view.insert(edit, line_region.a + offset, s)
-                line_num += 1
-                # Adjust for inserts.
-                offset += width + 1
+    def run(self, edit, start=1, step=1, separator=' ', strip_existing=False):
+        re_index = re.compile(rf'^-?\d+{re.escape(separator)}', re.MULTILINE)
+
+        # Last region first so earlier positions stay valid.
+        for region in sorted(sc.get_sel_regions(self.view), key=lambda r: r.begin(), reverse=True):
+            # Whole lines.
+            region = sublime.Region(self.view.line(region.begin()).begin(), region.end())
+            text = self.view.substr(region)
+            if strip_existing:
+                text = re_index.sub('', text)
+
+            lines = text.split('\n')
+            eol = ''
+            if len(lines) > 1 and lines[-1] == '':
+                # Don't number the nothing after the last newline.
+                lines.pop()
+                eol = '\n'
+
+            width = max(len(str(start)), len(str(start + step * (len(lines) - 1))))
+            indexes = itertools.count(start, step)
+            new = '\n'.join([f'{next(indexes):0{width}}{separator}{line}' for line in lines]) + eol
+            self.view.replace(edit, region, new)
+
+
+#-----------------------------------------------------------------------------------
+def _script_cmd(fn, path):
+    '''Command line to run a script file or None if it isn't one.'''
+    _, ext = os.path.splitext(fn)
+    if ext == '.py':
+        return ['python', path]
+    elif ext == '.lua':
+        return ['lua', path]
+    elif ext in ['.cmd', '.bat', '.sh']:
+        return [path]
+    return None
+
+
+#-----------------------------------------------------------------------------------
+def _can_run(settings):
+    '''Check the limit on runs at once.'''
+    max_runs = int(settings.get('run_max_concurrent', 4))   # pyright: ignore
+    if max_runs > 0 and len(_runs) >= max_runs:
+        sc.info(f'Already {len(_runs)} runs going, kill one first')
+        return False
+    return True
+
+
+#-----------------------------------------------------------------------------------
+def _start_proc(cmd, dir):
+    '''Start a script.'''
+    # Python buffers its output when it isn't a terminal. Don't, so it shows up as it happens.
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    return rc.Proc(cmd, cwd=dir, env=env)
+
+
+#-----------------------------------------------------------------------------------
+def _new_run_view(window, title):
+    '''Each run gets its own view, not the shared temp one. Returns (view, job name).'''
+    global _run_count
+    view = window.new_file()
+    view.set_scratch(True)
+    view.set_name(title)
+    _run_count += 1
+    name = f'Run {_run_count}'
+    _runs[view.id()] = name
+    return (view, name)
+
+
+#-----------------------------------------------------------------------------------
+def _pump(proc, timeout, sink):
+    '''
+    Job steps for a running proc. Copies its output to sink, or drops it if sink is None, and kills
+    it if it takes longer than timeout sec (0 = forever). Returns the exit code.
+    '''
+    while True:
+        # stdout and stderr interleaved as they arrive.
+        for _, text in proc.read():
+            if sink is not None:
+                sink.write(text)
+        if sink is not None:
+            sink.flush()
+
+        # Done unless something it started is still holding the pipes.
+        exit_code = proc.poll(wait_output=not proc.killed)
+        if exit_code is not None:
+            break
+
+        if timeout > 0 and proc.elapsed() > timeout and not proc.killed:
+            if sink is not None:
+                sink.write(f'\n===== Timed out after {timeout:g} sec =====\n')
+            proc.kill()
+
+        yield None
+
+    for _, text in proc.read():
+        if sink is not None:
+            sink.write(text)
+    return exit_code
+
+
+#-----------------------------------------------------------------------------------
+def _update_link_index(view):
+    '''
+    The links in view as a sorted list of regions. The first time finds them all, after that only
+    the lines changed since last time are scanned again. ST keeps the positions current for us.
+    The result must always be what a fresh find_all would give - check any change here against that.
+    '''
+    if view.id() not in _link_views:
+        links = view.find_all(_RE_LINK.pattern)
+        _link_views.add(view.id())
+    else:
+        links = view.get_regions(LINKS_KEY)
+        dirty = view.get_regions(LINKS_DIRTY_KEY)
+        if len(dirty) > 0:
+            # A change inside a link can stretch it over several lines so rescan all of those too.
+            links = sorted(links, key=lambda r: r.a)
+            touched = _touching(links, sc.merge_regions(dirty))
+            lines = sc.merge_regions([view.full_line(r) for r in dirty + [l for l, t in zip(links, touched) if t]])
+
+            # Keep the links that aren't in them and rescan the lines.
+            on_lines = _touching(links, lines, strict=True)
+            kept = [l for l, t in zip(links, on_lines) if not t and not l.empty()]
+            for line in lines:
+                kept.extend(sublime.Region(line.a + m.start(), line.a + m.end()) for m in _RE_LINK.finditer(view.substr(line)))
+            links = sorted(kept, key=lambda r: r.a)
+            view.erase_regions(LINKS_DIRTY_KEY)
+
+    view.add_regions(LINKS_KEY, links, flags=sublime.HIDDEN)
+    return links
+
+
+#-----------------------------------------------------------------------------------
+def _touching(regions, merged, strict=False):
+    '''For each of sorted regions, whether it touches any of merged. strict means they have to overlap.'''
+    ret = []
+    mi = 0
+    for region in regions:
+        while mi < len(merged) and (merged[mi].b <= region.a if strict else merged[mi].b < region.a):
+            mi += 1
+        ret.append(mi < len(merged) and (merged[mi].a < region.b if strict else merged[mi].a <= region.b))
+    return ret
+
+
+#-----------------------------------------------------------------------------------
+def _refresh_file_index(window, force=False):
+    '''Build the window's project file index in the background if its folders changed, or anyway if force.'''
+    folders = window.folders()
+    if not force and _index_roots.get(window.id()) == folders:
+        return
+    view = window.active_view()
+    if view is None:
+        return
+
+    _index_roots[window.id()] = folders
+    index = _file_indexes.setdefault(window.id(), tc.FileIndex())
+    settings = sublime.load_settings(sc.get_settings_fn())
+    ignore = settings.get('tree_ignore', [])
+    gitignore = bool(settings.get('tree_gitignore', True))
+    sc.start_job(f'Index {window.id()}', view, index.build(folders, _tree_cache, ignore, gitignore))
+
+
+#-----------------------------------------------------------------------------------
+def _command_paths(window, args):
+    '''The paths a file command was given, or the current file if none.'''
+    paths = []
+    for key in ('files', 'dirs', 'paths'):
+        paths.extend((args or {}).get(key) or [])
+    view = window.active_view()
+    if len(paths) == 0 and view is not None and view.file_name() is not None:
+        paths.append(view.file_name())
+    return paths
+
+
+#-----------------------------------------------------------------------------------
+def _update_file_index(window, paths=()):
+    '''Bring the window's index up to date with the paths a file command touched and the dirs still pending.'''
+    index = _file_indexes.get(window.id())
+    if index is None or not index.ready:
+        return # the build will see them
+
+    pending = _pending_dirs.setdefault(window.id(), {})
+    for path in paths:
+        if not os.path.exists(path):
+            index.remove(path)
+        pending.setdefault(os.path.dirname(os.path.normpath(path)), None)
+        if os.path.isdir(path): # new_folder gives the dir it goes in
+            pending.setdefault(os.path.normpath(path), None)
+
+    for dir, mtime in list(pending.items()):
+        try:
+            now = os.stat(dir).st_mtime_ns
+        except OSError:
+            del pending[dir] # gone with its parent
+            continue
+        if now != mtime:
+            index.refresh_dir(dir)
+            if mtime is None:
+                pending[dir] = now
+            else:
+                del pending[dir]
+
+
+#-----------------------------------------------------------------------------------
+def _resolve_path(view, link):
+    '''
+    Find the file link refers to, trying the view's dir then the project folders then files whose path ends with it.
+    Uses the project index first, then the disk for what it doesn't have - ignored files, places outside the
+    project, or files made elsewhere since it was read. Returns path or None.
+    '''
+    link = link.strip()
+    if len(link) == 0 or '://' in link: # urls aren't ours
+        return None
+
+    window = view.window()
+    fn = view.file_name()
+    bases = ([os.path.dirname(fn)] if fn is not None else []) + (window.folders() if window is not None else [])
+    index = _file_indexes.get(window.id()) if window is not None else None
+
+    if index is not None and index.ready:
+        path = index.resolve(link, bases)
+        if path is not None:
+            return path
+
+    for path in [link] if os.path.isabs(link) else [os.path.join(base, link) for base in bases]:
+        if os.path.exists(path):
+            return os.path.normpath(path)
+    return None
@@ -0,0 +1,92 @@
+# Benchmark for bin dump formatting: original per-byte rows vs binstr_core.format_block.
+# Run from anywhere: python bench_bin_dump.py [MB]
+
+import os
+import sys
+import time
+import importlib.util
+
+
+# Load the engine directly - the package itself needs sublime.
+_spec = importlib.util.spec_from_file_location('binstr_core', os.path.join(os.path.dirname(__file__), '..', 'binstr_core.py'))
+binstr_core = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(binstr_core)
+
+ROW_SIZE = 16
+
+
+#-----------------------------------------------------------------------------------
+def legacy_dump(data, addr):
+    '''The original do_work() row loop, with regions as tuples.'''
+    buff = []
+    regions_ascii = []
+    regions_unicode = []
+    out_pos = 0
+
+    for row_start in range(0, len(data), ROW_SIZE):
+        bytes = data[row_start:row_start + ROW_SIZE]
+        row_len = len(bytes)
+        lsrow = []
+        readable = ['    ']
+
+        def append_row_element(s):
+            nonlocal out_pos
+            lsrow.append(s)
+            out_pos += len(s)
+
+        append_row_element(f'0x{addr + row_start:04X}')
+        for i in range(0, row_len):
+            start_pos = out_pos + 1
+            v = bytes[i]
+            append_row_element(f' {v:02X}')
+            if v >= 32 and v <= 126:
+                readable.append(chr(v))
+            elif v < 32 or v == 127:
+                regions_ascii.append((start_pos, out_pos))
+                readable.append(' ')
+            else:
+                regions_unicode.append((start_pos, out_pos))
+                readable.append(' ')
+        for i in range(row_len, ROW_SIZE):
+            append_row_element(f' ..')
+        append_row_element(''.join(readable))
+        append_row_element('\n')
+        buff.append(''.join(lsrow))
+
+    return (''.join(buff), regions_ascii, regions_unicode)
+
+
+#-----------------------------------------------------------------------------------
+def block_dump(data, addr, chunk_size=64 * 1024):
+    '''New formatter, fed in chunks like do_work().'''
+    buff = []
+    regions_ascii = []
+    regions_unicode = []
+    out_pos = 0
+    for start in range(0, len(data), chunk_size):
+        text, sa, su = binstr_core.format_block(data[start:start + chunk_size], addr + start)
+        regions_ascii.extend((a + out_pos, b + out_pos) for a, b in sa)
+        regions_unicode.extend((a + out_pos, b + out_pos) for a, b in su)
+        buff.append(text)
+        out_pos += len(text)
+    return (''.join(buff), regions_ascii, regions_unicode)
+
+
+#-----------------------------------------------------------------------------------
+def bench(name, func, data):
+    start = time.perf_counter()
+    result = func(data, 0)
+    elapsed = time.perf_counter() - start
+    print(f'{name:8} {len(data) / elapsed / 1e6:8.2f} MB/s  {elapsed:.3f} s')
+    return result
+
+
+if __name__ == '__main__':
+    mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    # Mostly text with some binary sprinkled in, like a typical firmware image.
+    chunk = (b'The quick brown fox\x00\x01\x02 jumps over\x7f\xe2\x80\x99 the lazy dog.\r\n' * 64) + os.urandom(512)
+    data = (chunk * (int(mb * 1e6) // len(chunk) + 1))[:int(mb * 1e6)]
+
+    old_text, _, _ = bench('before', legacy_dump, data)
+    new_text, _, _ = bench('after', block_dump, data)
+    print('text identical' if old_text == new_text else 'TEXT DIFFERS')
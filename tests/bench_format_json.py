@@ -0,0 +1,136 @@
+# Benchmark for the json comment/whitespace pre-pass: original char loop vs format_core.clean_json.
+# Run from anywhere: python bench_format_json.py [MB]
+
+import os
+import sys
+import time
+import enum
+import string
+import tracemalloc
+import importlib.util
+
+
+# Load the engine directly - the package itself needs sublime.
+_spec = importlib.util.spec_from_file_location('format_core', os.path.join(os.path.dirname(__file__), '..', 'format_core.py'))
+format_core = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(format_core)
+
+
+#-----------------------------------------------------------------------------------
+def legacy_clean(s):
+    '''The original SbotFormatJsonCommand.run() scanner.'''
+
+    class ScanState(enum.IntFlag):
+        DEFAULT = enum.auto()
+        STRING = enum.auto()
+        LCOMMENT = enum.auto()
+        BCOMMENT = enum.auto()
+        DONE = enum.auto()
+
+    comment_count = 0
+    sreg = []
+    state = ScanState.DEFAULT
+    current_comment = []
+    escaped = False
+    pos_map = []
+
+    slen = len(s)
+    i = 0
+    while i < slen:
+        current_char = s[i]
+        next_char = s[i + 1] if i < slen - 1 else -1
+
+        if state == ScanState.STRING:
+            sreg.append(current_char)
+            pos_map.append(i)
+            if current_char == '\\':
+                escaped = True
+            elif current_char == '\"':
+                if not escaped:
+                    state = ScanState.DEFAULT
+                escaped = False
+            else:
+                escaped = False
+
+        elif state == ScanState.LCOMMENT:
+            if current_char == '\n':
+                scom = ''.join(current_comment)
+                stag = f'\"//{comment_count}\":\"{scom}\",'
+                comment_count += 1
+                sreg.append(stag)
+                pos_map.append(i)
+                state = ScanState.DEFAULT
+                current_comment.clear()
+            elif current_char == '\r':
+                pass
+            else:
+                if current_char == '\"' or current_char == '\\':
+                    current_comment.append('\\')
+                current_comment.append(current_char)
+
+        elif state == ScanState.BCOMMENT:
+            if current_char == '*' and next_char == '/':
+                scom = ''.join(current_comment)
+                stag = f'\"//{comment_count}\":\"{scom}\",'
+                comment_count += 1
+                sreg.append(stag)
+                pos_map.append(i)
+                state = ScanState.DEFAULT
+                current_comment.clear()
+                i += 1
+            elif current_char == '\n' or current_char == '\r':
+                pass
+            else:
+                if current_char == '\"' or current_char == '\\':
+                    current_comment.append('\\')
+                current_comment.append(current_char)
+
+        elif state == ScanState.DEFAULT:
+            if current_char == '/' and next_char == '/':
+                state = ScanState.LCOMMENT
+                current_comment.clear()
+                i += 1
+            elif current_char == '/' and next_char == '*':
+                state = ScanState.BCOMMENT
+                current_comment.clear()
+                i += 1
+            elif current_char == '\"':
+                sreg.append(current_char)
+                pos_map.append(i)
+                state = ScanState.STRING
+            elif current_char not in string.whitespace:
+                sreg.append(current_char)
+                pos_map.append(i)
+        i += 1
+
+    return (''.join(sreg), pos_map)
+
+
+#-----------------------------------------------------------------------------------
+def bench(name, func, s):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(s)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:8} {len(s) / elapsed / 1e6:8.2f} MB/s  {elapsed:.3f} s  peak {peak / 1e6:.1f} MB')
+    return result
+
+
+if __name__ == '__main__':
+    mb = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    item = '''    {
+        // Line comment with "quotes" and \\ slash.
+        "name": "item with \\"escapes\\" and // not a comment",
+        "values": [1, 2.5, -3e4, true, false, null], /* block
+        comment */
+        "nested": { "a": "b", "c": [ { }, [ ] ] },
+    },
+'''
+    count = int(mb * 1e6) // len(item) + 1
+    s = '[\n' + item * count + ']\n'
+
+    old_text, _ = bench('before', legacy_clean, s)
+    new_text, _ = bench('after', format_core.clean_json, s)
+    print('text identical' if old_text == new_text else 'TEXT DIFFERS')
@@ -0,0 +1,384 @@
+import os
+import re
+import fnmatch
+import threading
+import collections
+
+
+# Dir walking with listing cache and gitignore rules for sbot_tree, and the project file index behind sbot_open_context_path.
+
+
+# Line prefixes: (middle entry, last entry, continuing, done).
+TREE_ASCII = ('+---', '\\---', '|   ', '    ')
+TREE_UNICODE = ('├── ', '└── ', '│   ', '    ')
+
+
+#-----------------------------------------------------------------------------------
+class DirCache(object):
+    '''
+    Directory listings keyed on the dir's mtime so walking an unchanged tree again doesn't hit scandir.
+    Adding, removing or renaming an entry bumps the mtime of its dir so the listing is redone.
+    Only names and types are kept - sizes change without touching the dir so they are always fresh.
+    '''
+
+    def __init__(self):
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+    def listdir(self, path):
+        '''Returns sorted list of (name, is_dir). Dirs first. Raises OSError.'''
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._dirs.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with os.scandir(path) as it:
+            entries = [(e.name, e.is_dir(follow_symlinks=False)) for e in it]
+        entries.sort(key=lambda e: (not e[1], e[0].lower()))
+        with self._lock:
+            self._dirs[path] = (mtime, entries)
+        return entries
+
+    def clear(self):
+        with self._lock:
+            self._dirs.clear()
+
+
+#-----------------------------------------------------------------------------------
+class IgnoreRules(object):
+    '''
+    Ignore patterns like a .gitignore - last match wins, ! negates, trailing / is dirs only, a / anywhere
+    else anchors the pattern to the dir the rules came from. Immutable, child() makes a new one for a subdir.
+    '''
+
+    def __init__(self, rules=None):
+        # List of (base dir, regex, negate, dir_only).
+        self._rules = rules or []
+
+    def child(self, dir, patterns):
+        '''Rules for dir with more patterns from it.'''
+        rules = [_compile_rule(dir, p) for p in patterns]
+        rules = [r for r in rules if r is not None]
+        return IgnoreRules(self._rules + rules) if len(rules) > 0 else self
+
+    def is_ignored(self, path, is_dir):
+        ignored = False
+        name = os.path.basename(path)
+        for base, rex, negate, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if base is None: # plain name pattern
+                target = name
+            else:
+                target = path[len(base) + 1:].replace(os.sep, '/')
+            if rex.fullmatch(target):
+                ignored = not negate
+        return ignored
+
+
+#-----------------------------------------------------------------------------------
+def read_gitignore(dir):
+    '''Patterns from dir/.gitignore or empty.'''
+    try:
+        with open(os.path.join(dir, '.gitignore'), 'r', encoding='utf-8', errors='replace') as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+#-----------------------------------------------------------------------------------
+def walk_tree(root, cache, max_depth=0, ignore=(), gitignore=True, sizes=False, chars=TREE_ASCII):
+    '''
+    Generate the tree under root a line at a time. max_depth 0 is all. ignore is a list of
+    patterns applied everywhere. Yields (line, progress) where progress is the fraction of root done.
+    '''
+    rules = IgnoreRules().child(None, ignore)
+    yield (root, 0.0)
+
+    def open_dir(path, rules):
+        try:
+            entries = cache.listdir(path)
+        except OSError as e:
+            return rules, [], str(e)
+        if gitignore and ('.gitignore', False) in entries:
+            rules = rules.child(path, read_gitignore(path))
+        entries = [(n, d) for n, d in entries if not rules.is_ignored(os.path.join(path, n), d)]
+        return rules, entries, None
+
+    rules, entries, err = open_dir(root, rules)
+    if err is not None:
+        yield (f'{chars[1]}<{err}>', 1.0)
+        return
+
+    # Depth first using a stack of (dir, rules, prefix, depth, entries, next entry index).
+    total = max(len(entries), 1)
+    stack = [(root, rules, '', 1, entries, 0)]
+    while len(stack) > 0:
+        path, rules, prefix, depth, entries, i = stack.pop()
+        if i >= len(entries):
+            continue
+        stack.append((path, rules, prefix, depth, entries, i + 1))
+
+        name, is_dir = entries[i]
+        last = i == len(entries) - 1
+        full = os.path.join(path, name)
+        progress = stack[0][5] / total
+
+        if sizes and not is_dir:
+            try:
+                size = fmt_size(os.stat(full).st_size)
+            except OSError:
+                size = '?'
+            yield (f'{prefix}{chars[1] if last else chars[0]}{name}  {size}', progress)
+        else:
+            yield (f'{prefix}{chars[1] if last else chars[0]}{name}', progress)
+
+        if is_dir and (max_depth <= 0 or depth < max_depth):
+            sub_rules, sub_entries, err = open_dir(full, rules)
+            sub_prefix = prefix + (chars[3] if last else chars[2])
+            if err is not None:
+                yield (f'{sub_prefix}{chars[1]}<{err}>', progress)
+            elif len(sub_entries) > 0:
+                stack.append((full, sub_rules, sub_prefix, depth + 1, sub_entries, 0))
+
+
+#-----------------------------------------------------------------------------------
+class FileIndex(object):
+    '''
+    All the files and dirs under some roots, for looking up paths without going to the disk.
+    build() walks in chunks and swaps the result in at the end so lookups keep working meanwhile.
+    After that refresh_dir() and remove() keep it current one dir at a time.
+    Keys are normcase'd so lookups match the way the OS does.
+    '''
+
+    def __init__(self):
+        self.roots = []
+        self.ready = False
+        self._paths = {}  # normcase path -> path
+        self._by_name = collections.defaultdict(set)  # normcase basename -> normcase paths
+        self._children = collections.defaultdict(set)  # normcase dir -> normcase paths in it
+        self._cache = None
+        self._ignore = ()
+        self._gitignore = True
+        self._lock = threading.Lock()
+
+    def build(self, roots, cache, ignore=(), gitignore=True, chunk_size=200):
+        '''Generator that walks roots chunk_size dirs at a time, yielding rough progress.'''
+        paths = {}
+        by_name = collections.defaultdict(set)
+        children = collections.defaultdict(set)
+        rules = IgnoreRules().child(None, ignore)
+        todo = [(root, rules) for root in roots]
+        done = 0
+
+        while len(todo) > 0:
+            for _ in range(min(chunk_size, len(todo))):
+                path, rules = todo.pop()
+                todo.extend(self._scan_dir(path, rules, cache, gitignore, paths, by_name, children))
+                done += 1
+            yield done / (done + len(todo))
+
+        with self._lock:
+            self.roots = list(roots)
+            self._paths = paths
+            self._by_name = by_name
+            self._children = children
+            self._cache = cache
+            self._ignore = ignore
+            self._gitignore = gitignore
+            self.ready = True
+
+    def refresh_dir(self, dir):
+        '''Read one indexed dir again, dropping what's gone from it and adding what's new with everything under it.'''
+        dir = os.path.normpath(os.path.abspath(dir))
+        key = os.path.normcase(dir)
+        root = next((r for r in self.roots if _is_under(key, r)), None)
+        with self._lock:
+            if not self.ready or root is None or (key != os.path.normcase(root) and key not in self._paths):
+                return
+            known = set(self._children.get(key, ()))
+
+        # Rules for dir are the ones from the .gitignores on the way down to it.
+        rules = IgnoreRules().child(None, self._ignore)
+        if self._gitignore and key != os.path.normcase(root):
+            path = root
+            for part in os.path.relpath(dir, root).split(os.sep):
+                rules = rules.child(path, read_gitignore(path))
+                path = os.path.join(path, part)
+
+        paths = {}
+        by_name = collections.defaultdict(set)
+        children = collections.defaultdict(set)
+        todo = [(dir, rules)]
+        while len(todo) > 0:
+            path, rules = todo.pop()
+            subdirs = self._scan_dir(path, rules, self._cache, self._gitignore, paths, by_name, children)
+            # Subdirs already indexed are unchanged as far as this is concerned.
+            todo.extend((d, r) for d, r in subdirs if path != dir or os.path.normcase(d) not in known)
+
+        with self._lock:
+            for gone in known - children[key]:
+                self._remove(gone)
+            self._paths.update(paths)
+            for name, keys in by_name.items():
+                self._by_name[name] |= keys
+            for dir_key, keys in children.items():
+                self._children[dir_key] |= keys
+
+    def add(self, path):
+        '''A new or saved file. Ignored if not under one of the roots.'''
+        if not self.covers(path):
+            return
+        key = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            self._paths[key] = path
+            self._by_name[os.path.basename(key)].add(key)
+            self._children[os.path.dirname(key)].add(key)
+
+    def remove(self, path):
+        '''A deleted file or dir, and everything under it.'''
+        with self._lock:
+            self._remove(os.path.normcase(os.path.abspath(path)))
+
+    def resolve(self, link, bases):
+        '''
+        Find the file or dir link refers to. Tries it as is, then relative to each of bases in order,
+        then anything else whose path ends with all the named parts of link, the closest to the first
+        base winning. Returns the path or None.
+        '''
+        link = os.path.normpath(link.strip())
+        with self._lock:
+            if os.path.isabs(link):
+                return self._paths.get(os.path.normcase(link))
+
+            for base in bases:
+                path = self._paths.get(os.path.normcase(os.path.normpath(os.path.join(base, link))))
+                if path is not None:
+                    return path
+
+            # The .. parts say nothing about where it is, the rest must all match.
+            parts = [p for p in os.path.normcase(link).split(os.sep) if p not in ('..', '.', '')]
+            if len(parts) == 0:
+                return None
+            tail = os.sep + os.sep.join(parts)
+            matches = [k for k in self._by_name.get(parts[-1], ()) if k.endswith(tail)]
+            if len(matches) == 0:
+                return None
+            near = os.path.normcase(bases[0]).split(os.sep) if len(bases) > 0 else []
+            return self._paths[max(matches, key=lambda k: (len(os.path.commonprefix([k.split(os.sep), near])), k))]
+
+    def covers(self, path):
+        '''True if path is under one of the roots.'''
+        key = os.path.normcase(os.path.abspath(path))
+        return any(_is_under(key, r) for r in self.roots)
+
+    def _scan_dir(self, path, rules, cache, gitignore, paths, by_name, children):
+        '''Add the entries of one dir to the dicts. Returns [(subdir, rules)] to do next.'''
+        try:
+            entries = cache.listdir(path)
+        except OSError:
+            return []
+        if gitignore and ('.gitignore', False) in entries:
+            rules = rules.child(path, read_gitignore(path))
+        subdirs = []
+        dir_key = os.path.normcase(path)
+        for name, is_dir in entries:
+            full = os.path.join(path, name)
+            if rules.is_ignored(full, is_dir):
+                continue
+            key = os.path.normcase(full)
+            paths[key] = full
+            by_name[os.path.normcase(name)].add(key)
+            children[dir_key].add(key)
+            if is_dir:
+                subdirs.append((full, rules))
+        return subdirs
+
+    def _remove(self, key):
+        # Lock held.
+        if self._paths.pop(key, None) is None:
+            return
+        self._by_name[os.path.basename(key)].discard(key)
+        self._children[os.path.dirname(key)].discard(key)
+        for child in self._children.pop(key, set()):
+            self._remove(child)
+
+
+#-----------------------------------------------------------------------------------
+def fmt_size(size):
+    '''Human size.'''
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024 or unit == 'G':
+            return f'{size}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+
+
+#-----------------------------------------------------------------------------------
+def _is_under(key, root):
+    '''True if normcase'd key is root or in it.'''
+    return key == os.path.normcase(root) or key.startswith(os.path.normcase(os.path.join(root, '')))
+
+
+#-----------------------------------------------------------------------------------
+def _compile_rule(base, pattern):
+    '''One gitignore line to (base, regex, negate, dir_only) or None. base None means match names anywhere.'''
+    pattern = pattern.rstrip()
+    if pattern == '' or pattern.startswith('#'):
+        return None
+
+    negate = pattern.startswith('!')
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if pattern == '':
+        return None
+
+    if '/' not in pattern:
+        return (None, re.compile(fnmatch.translate(pattern)), negate, dir_only) if base is None else \
+               (base, re.compile('(?:.*/)?' + _glob_to_regex(pattern)), negate, dir_only)
+    return (base, re.compile(_glob_to_regex(pattern.lstrip('/'))), negate, dir_only)
+
+
+#-----------------------------------------------------------------------------------
+def _glob_to_regex(pattern):
+    '''Gitignore glob to regex source. * and ? don't cross /, ** does.'''
+    parts = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == n:
+            parts.append('/.*')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif c == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif c == '?':
+            parts.append('[^/]')
+            i += 1
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j < 0:
+                parts.append(re.escape(c))
+                i += 1
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append(f'[{body}]')
+                i = j + 1
+        elif c == '\\' and i + 1 < n:
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(c))
+            i += 1
+    return ''.join(parts)